@@ -5,6 +5,7 @@ Convert raw Erez Aiden K562 micro-C loop calls to parquet.
 - Add center and id columns
 """
 import polars as pl
+from common.tables import write_table
 
 # New labels for all the columns in the original bedpe
 loops_header = [
@@ -19,32 +20,37 @@ loops_header = [
 ]
 
 
-loops = (
-    # Load in the bedpe
-    pl.read_csv(
-        "raw/Loops/localizedList_primary_10.bedpe",
-        separator="\t",
-        comment_prefix="#",
-        has_header=False,
-        new_columns=loops_header
-    )
+def extract_loops(bedpe_path: str = "raw/Loops/localizedList_primary_10.bedpe") -> dict[str, pl.DataFrame]:
+    loops = (
+        # Load in the bedpe
+        pl.read_csv(
+            bedpe_path,
+            separator="\t",
+            comment_prefix="#",
+            has_header=False,
+            new_columns=loops_header
+        )
 
-    # Add center columns
-    .with_columns(
-        center1 = (pl.col.start1+pl.col.end1)//2,
-        center2 = (pl.col.start2+pl.col.end2)//2,
-    )
+        # Add center columns
+        .with_columns(
+            center1 = (pl.col.start1+pl.col.end1)//2,
+            center2 = (pl.col.start2+pl.col.end2)//2,
+        )
 
-    # Add row index
-    .with_row_index('loop_id')
+        # Add row index
+        .with_row_index('loop_id')
 
-    # Select id, position, and O/E columns
-    .select(
-        'loop_id', # Unique loop ID
-        'chrom1', 'start1', 'center1', 'end1', 'chrom2', 'start2', 'center2', 'end2', # Position
-        "observed", "expectedBL", "expectedDonut", "expectedH", "expectedV" # Loop strength
+        # Select id, position, and O/E columns
+        .select(
+            'loop_id', # Unique loop ID
+            'chrom1', 'start1', 'center1', 'end1', 'chrom2', 'start2', 'center2', 'end2', # Position
+            "observed", "expectedBL", "expectedDonut", "expectedH", "expectedV" # Loop strength
+        )
     )
-)
-print("loops")
-print(loops)
-loops.write_parquet("output/data/loops.parquet")
\ No newline at end of file
+    return {"loops": loops}
+
+if __name__ == "__main__":
+    loops = extract_loops()["loops"]
+    print("loops")
+    print(loops)
+    write_table(loops, "output/data/loops.parquet")
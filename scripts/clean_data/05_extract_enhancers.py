@@ -1,29 +1,37 @@
 #%%
 import duckdb
 import polars as pl
+from common.tables import write_table
 
-# Kuei consensus enhancers
-# Add center position
-# Mark Group = "*:Repressive" as "silencer" = True
-# Add index
-enhancers = (
-    duckdb.read_csv("raw/Kuei_enhancers/region.annotation.fcc_starrmpra.group.2025.08.22.tsv")
-    .pl()
-    .rename({
-        "Chrom":"chrom",
-        "ChromStart":"start",
-        "ChromEnd":"end",
-    })
-    .with_columns(
-        center = (pl.col.start + pl.col.end)//2,
-        silencer = pl.col.Group.str.extract("(.*):(.*)",2) == pl.lit("Repressive")
+def extract_enhancers(
+        path: str = "raw/Kuei_enhancers/region.annotation.fcc_starrmpra.group.2025.08.22.tsv"
+    ) -> dict[str, pl.DataFrame]:
+    # Kuei consensus enhancers
+    # Add center position
+    # Mark Group = "*:Repressive" as "silencer" = True
+    # Add index
+    enhancers = (
+        duckdb.read_csv(path)
+        .pl()
+        .rename({
+            "Chrom":"chrom",
+            "ChromStart":"start",
+            "ChromEnd":"end",
+        })
+        .with_columns(
+            center = (pl.col.start + pl.col.end)//2,
+            silencer = pl.col.Group.str.extract("(.*):(.*)",2) == pl.lit("Repressive")
+        )
+        .drop("Region", "Group")
+        .sort("chrom", "start", "end")
+        .with_row_index("enhancer_id")
+        
     )
-    .drop("Region", "Group")
-    .sort("chrom", "start", "end")
-    .with_row_index("enhancer_id")
-    
-)
-print("enhancers")
-enhancers.write_parquet("output/data/enhancers.parquet")
-enhancers
+    return {"enhancers": enhancers}
+
+if __name__ == "__main__":
+    enhancers = extract_enhancers()["enhancers"]
+    print("enhancers")
+    print(enhancers)
+    write_table(enhancers, "output/data/enhancers.parquet")
 # %%
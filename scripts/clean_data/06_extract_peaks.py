@@ -1,9 +1,11 @@
 #%%
 import duckdb
 import polars as pl
+from common.genomic_polars import merge_intervals
+from common.tables import write_table
 
 # 1. Extract CTCF, RAD21, SMC3 peaks to parquet
-# 2. Get union set of RAD21 and SMC3 peaks as "cohesin" peaks
+# 2. Get union set of RAD21 and SMC3 peaks as "cohesin" peaks, merging overlaps
 
 def extract_tf(name, path):
     df = (
@@ -21,28 +23,48 @@ def extract_tf(name, path):
         .sort("chrom", "start", "end")
         .with_row_index(f"{name}_id")
     )
-    print(name)
-    print(df)
-    df.write_parquet(f"output/data/{name}.parquet")
-
     return df
 
-def combine_tfs(name, *dfs):
-    shared_cols = set(dfs[0].columns)
-    for df in dfs:
-        shared_cols = shared_cols.intersection(df.columns)
-    dfs = [df.select(shared_cols) for df in dfs]
+def combine_tfs(name, tfs: dict[str, pl.DataFrame], min_factors: int = 1):
+    # Overlapping peaks of different factors are merged into one peak.
+    # 'factors' lists the factors supporting each merged peak and
+    # '{factor}_id' lists the ids of the source peaks of each factor.
+    peaks = pl.concat(
+        [
+            df.select(f"{factor}_id", "chrom", "start", "end").with_columns(factor=pl.lit(factor))
+            for factor, df in tfs.items()
+        ],
+        how="diagonal"
+    )
     df = (
-        pl.concat(dfs, how="vertical")
+        merge_intervals(
+            peaks,
+            source_col="factor",
+            min_sources=min_factors,
+            aggs=[pl.col(f"{factor}_id").drop_nulls() for factor in tfs]
+        )
+        .rename({"sources": "factors"})
+        .with_columns(center = (pl.col.start + pl.col.end)//2)
+        .select("chrom", "start", "center", "end", "factors", *[f"{factor}_id" for factor in tfs])
         .with_row_index(f"{name}_id")
     )
-    print(name)
-    print(df)
-    df.write_parquet(f"output/data/{name}.parquet")
+    return df
+
+def extract_peaks(
+        ctcf_path: str = "raw/TF_ChIP/pooled_cons_IDR_peaks/CTCF_ENCFF901CBP.bed.gz",
+        rad21_path: str = "raw/TF_ChIP/pooled_cons_IDR_peaks/RAD21_ENCFF439DYW.bed.gz",
+        smc3_path: str = "raw/TF_ChIP/pooled_cons_IDR_peaks/SMC3_ENCFF289LLT.bed.gz"
+    ) -> dict[str, pl.DataFrame]:
+    ctcf = extract_tf("CTCF", ctcf_path)
+    rad21 = extract_tf("RAD21", rad21_path)
+    smc3 = extract_tf("SMC3", smc3_path)
+    cohesin = combine_tfs("cohesin", {"RAD21": rad21, "SMC3": smc3})
+    return {"CTCF": ctcf, "RAD21": rad21, "SMC3": smc3, "cohesin": cohesin}
 
-ctcf = extract_tf("CTCF", "raw/TF_ChIP/pooled_cons_IDR_peaks/CTCF_ENCFF901CBP.bed.gz")
-rad21 = extract_tf("RAD21", "raw/TF_ChIP/pooled_cons_IDR_peaks/RAD21_ENCFF439DYW.bed.gz")
-smc3 = extract_tf("SMC3", "raw/TF_ChIP/pooled_cons_IDR_peaks/SMC3_ENCFF289LLT.bed.gz")
-combine_tfs("cohesin", rad21, smc3)
+if __name__ == "__main__":
+    for name, df in extract_peaks().items():
+        print(name)
+        print(df)
+        write_table(df, f"output/data/{name}.parquet")
 
 # %%
@@ -1,66 +1,83 @@
 #%%
 import polars as pl
-from typing import Callable, Dict, Any
-from functools import partial
-from common.genomic_polars import partition_overlaps, nearest
+from common.genomic_polars import nearest_many, nearest_stranded, partition_overlaps
+from common.position_index import PositionIndex
+from common.tables import write_table
 
-# Label anchors with distance to nearest promoter, enhancer, cohesin peak
-anchors = pl.read_parquet("output/data/anchors.parquet")
-enhancers = (
-    pl.read_parquet("output/data/enhancers.parquet")
-    .select("enhancer_id", "chrom", "center")
-)
-transcripts = (
-    pl.read_parquet("output/data/transcript_quant.parquet")
-    .select("transcript_id", "chrom", "tss")
-)
-cohesin = (
-    pl.read_parquet("output/data/cohesin.parquet")
-    .select("cohesin_id", "chrom", "center")
-)
+def anchor_neighbors(
+        anchors: pl.DataFrame | pl.LazyFrame,
+        enhancers: pl.DataFrame | pl.LazyFrame,
+        transcript_quant: pl.DataFrame | pl.LazyFrame,
+        cohesin: pl.DataFrame | pl.LazyFrame,
+        indexes: dict[str, PositionIndex] = None
+    ) -> dict[str, pl.DataFrame]:
+    # Label anchors with distance to nearest promoter, enhancer, cohesin peak
+    # Only these columns are read when the inputs are scans
+    anchors = anchors.lazy().collect()
+    enhancers = enhancers.lazy().select("enhancer_id", "chrom", "center").collect()
+    transcripts = transcript_quant.lazy().select("transcript_id", "chrom", "tss", "strand").collect()
+    cohesin = cohesin.lazy().select("cohesin_id", "chrom", "center").collect()
 
-nearest_partial = partial(
-    nearest, 
-    from_cols = ["center"], 
-    query_kw = {"k": 1}
-)
-genomic_nearest = partial(
-    partition_overlaps,
-    func = nearest_partial,
-    partition_by = ["chrom"]
-)
-anchor_neighbors = genomic_nearest(
-    df1=anchors, 
-    df2=enhancers, 
-    kw={
-        "to_cols": ["center"], 
-        "dist_col": "nn_dist_enh", 
-        "to_df_col": "nn_{col}",
-        "join_to_df_cols": ["enhancer_id"]
-    }
-)
-anchor_neighbors = genomic_nearest(
-    df1=anchor_neighbors, 
-    df2=transcripts, 
-    kw={
-        "to_cols": ["tss"], 
-        "dist_col": "nn_dist_tss", 
-        "to_df_col": "nn_{col}",
-        "join_to_df_cols": ["transcript_id"]
-    }
-)
-anchor_neighbors = genomic_nearest(
-    df1=anchor_neighbors, 
-    df2=cohesin, 
-    kw={
-        "to_cols": ["center"], 
-        "dist_col": "nn_dist_coh", 
-        "to_df_col": "nn_{col}",
-        "join_to_df_cols": ["cohesin_id"]
-    }
-)
+    # Partition anchors by chromosome once and label with every target together
+    anchor_neighbors = nearest_many(
+        from_df=anchors,
+        to_dfs={
+            "enh": enhancers,
+            "tss": transcripts,
+            "coh": cohesin,
+        },
+        from_cols=["center"],
+        to_cols={
+            "enh": ["center"],
+            "tss": ["tss"],
+            "coh": ["center"],
+        },
+        join_to_df_cols={
+            "enh": ["enhancer_id"],
+            "tss": ["transcript_id"],
+            "coh": ["cohesin_id"],
+        },
+        partition_by=["chrom"],
+        dist_col="nn_dist_{name}",
+        to_df_col="nn_{col}",
+        query_kw={"k": 1},
+        executor="thread",
+        indexes=indexes
+    )
 
-anchor_neighbors.write_parquet("output/data/anchor_neighbors.parquet")
-print("anchor_neighbors")
-print(anchor_neighbors)
+    # Signed distance to the nearest TSS overall, upstream and downstream
+    # (negative = anchor is upstream of the TSS)
+    anchor_neighbors = partition_overlaps(
+        nearest_stranded,
+        anchor_neighbors,
+        transcripts,
+        partition_by=["chrom"],
+        how="left",
+        executor="thread",
+        kw={
+            "from_col": "center",
+            "to_col": "tss",
+            "join_to_df_cols": ["transcript_id"],
+            "dist_col": "nn_sdist_tss_{direction}",
+            "to_df_col": "nn_{col}_{direction}",
+        }
+    )
+    return {"anchor_neighbors": anchor_neighbors}
+
+if __name__ == "__main__":
+    neighbors = anchor_neighbors(
+        anchors=pl.scan_parquet("output/data/anchors.parquet"),
+        enhancers=pl.scan_parquet("output/data/enhancers.parquet"),
+        transcript_quant=pl.scan_parquet("output/data/transcript_quant.parquet"),
+        cohesin=pl.scan_parquet("output/data/cohesin.parquet"),
+        # Sorted target positions are cached on disk and rebuilt only when a source changes
+        indexes={
+            "enh": PositionIndex.load("output/data/enhancers.parquet", ["center"]),
+            "tss": PositionIndex.load("output/data/transcript_quant.parquet", ["tss"]),
+            "coh": PositionIndex.load("output/data/cohesin.parquet", ["center"]),
+        }
+    )["anchor_neighbors"]
+    write_table(neighbors, "output/data/anchor_neighbors.parquet")
+    print("anchor_neighbors")
+    print(neighbors)
 # %%
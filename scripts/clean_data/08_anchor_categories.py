@@ -1,29 +1,29 @@
 #%%
 import polars as pl
-from params import BPThresholds, ProxDistAbbr
+from params import BPThresholds, ProxFlag
+from common.tables import write_table
 
-anchors = (
-    pl.read_parquet("output/data/anchor_neighbors.parquet")
-    .with_columns(
-        nn_enh = (
-            pl.when(pl.col.nn_dist_enh <= BPThresholds.enhancer_is_proximal)
-            .then(pl.lit(ProxDistAbbr.prox))
-            .otherwise(pl.lit(ProxDistAbbr.dist))
-        ),
-        nn_pro = (
-            pl.when(pl.col.nn_dist_tss <= BPThresholds.promoter_is_proximal)
-            .then(pl.lit(ProxDistAbbr.prox))
-            .otherwise(pl.lit(ProxDistAbbr.dist))
-        ),
-        nn_coh = (
-            pl.when(pl.col.nn_dist_coh <= BPThresholds.cohesin_is_proximal)
-            .then(pl.lit(ProxDistAbbr.prox))
-            .otherwise(pl.lit(ProxDistAbbr.dist))
+def anchor_categories(anchor_neighbors: pl.DataFrame | pl.LazyFrame) -> dict[str, pl.DataFrame]:
+    # prox is a UInt8 mask of ProxFlag bits for proximal enhancer, promoter and cohesin
+    anchors = (
+        anchor_neighbors.lazy()
+        .with_columns(
+            prox = ProxFlag.mask(
+                enh = pl.col.nn_dist_enh <= BPThresholds.enhancer_is_proximal,
+                pro = pl.col.nn_dist_tss <= BPThresholds.promoter_is_proximal,
+                coh = pl.col.nn_dist_coh <= BPThresholds.cohesin_is_proximal,
+            )
         )
+        .select("anchor", "anchor_id", "loop_id", "chrom", "start", "end", "prox")
+        .collect()
     )
-    .select("anchor", "anchor_id", "loop_id", "chrom", "start", "end", "nn_enh", "nn_pro", "nn_coh")
-)
-print("anchor_categories")
-print(anchors)
-anchors.write_parquet("output/data/anchor_categories.parquet")
+    return {"anchor_categories": anchors}
+
+if __name__ == "__main__":
+    anchors = anchor_categories(
+        anchor_neighbors=pl.scan_parquet("output/data/anchor_neighbors.parquet")
+    )["anchor_categories"]
+    print("anchor_categories")
+    print(anchors)
+    write_table(anchors, "output/data/anchor_categories.parquet")
 # %%
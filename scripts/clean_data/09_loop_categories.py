@@ -1,36 +1,46 @@
 import polars as pl
-from params import ProxDistAbbr, LoopCohesinCategoryAbbr, LoopRegulatoryCategoryAbbr
+from params import LoopCohesinCategoryAbbr, LoopRegulatoryCategoryAbbr
+from common.tables import write_table
 
-anchors = pl.read_parquet("output/data/anchor_categories.parquet")
-a1 = (
-    anchors.filter(pl.col.anchor == pl.lit(1))
-    .drop("anchor")
-    .rename({
-        col: col + "1"
-        for col in anchors.columns 
-        if col not in ["loop_id", "anchor"]
-    })
-)
-a2 = (
-    anchors.filter(pl.col.anchor == pl.lit(2))
-    .drop("anchor")
-    .rename({
-        col: col + "2"
-        for col in anchors.columns 
-        if col not in ["loop_id", "anchor"]
-    })    
-)
+def loop_categories(anchor_categories: pl.DataFrame | pl.LazyFrame) -> dict[str, pl.DataFrame]:
+    anchors = anchor_categories.lazy()
+    columns = anchors.collect_schema().names()
+    a1 = (
+        anchors.filter(pl.col.anchor == pl.lit(1))
+        .drop("anchor")
+        .rename({
+            col: col + "1"
+            for col in columns 
+            if col not in ["loop_id", "anchor"]
+        })
+    )
+    a2 = (
+        anchors.filter(pl.col.anchor == pl.lit(2))
+        .drop("anchor")
+        .rename({
+            col: col + "2"
+            for col in columns 
+            if col not in ["loop_id", "anchor"]
+        })    
+    )
 
-loop_categories = a1.join(a2, on="loop_id")
-loop_categories = (
-    loop_categories.with_columns(
-        cohesin = LoopCohesinCategoryAbbr.label(loop_categories, "nn_coh1", "nn_coh2"),
-        regulation = LoopRegulatoryCategoryAbbr.label(loop_categories, "nn_pro1", "nn_enh1", "nn_pro2", "nn_enh2"),
+    loop_categories = a1.join(a2, on="loop_id")
+    loop_categories = (
+        loop_categories.with_columns(
+            # Enum categories looked up from both anchors' proximity masks
+            cohesin = LoopCohesinCategoryAbbr.label("prox1", "prox2"),
+            regulation = LoopRegulatoryCategoryAbbr.label("prox1", "prox2"),
+        )
+        .select("loop_id", "chrom1", "start1", "end1", "chrom2", "start2", "end2", "cohesin", "regulation")
+        .collect()
     )
-    .select("loop_id", "chrom1", "start1", "end1", "chrom2", "start2", "end2", "cohesin", "regulation")
-)
+    return {"loop_categories": loop_categories}
 
-print("loop_categories")
-with pl.Config(set_tbl_cols=-1):
-    print(loop_categories)
-loop_categories.write_parquet("output/data/loop_categories.parquet")
\ No newline at end of file
+if __name__ == "__main__":
+    loops = loop_categories(
+        anchor_categories=pl.scan_parquet("output/data/anchor_categories.parquet")
+    )["loop_categories"]
+    print("loop_categories")
+    with pl.Config(set_tbl_cols=-1):
+        print(loops)
+    write_table(loops, "output/data/loop_categories.parquet")
@@ -2,75 +2,66 @@
 import polars as pl
 import duckdb
 from common import genomic_polars
+from common.position_index import PositionIndex
+from common.tables import write_table
 
-anchors = pl.read_parquet("output/data/anchors.parquet")
-enhancers = pl.read_parquet("output/data/enhancers.parquet")
-transcripts = pl.read_parquet("output/data/transcript_quant.parquet")
-anchor_neighbors = pl.read_parquet("output/data/anchor_neighbors.parquet")
-with duckdb.connect() as conn:
-    transcripts_enhancer_distal = conn.execute(
-"""
-SELECT *
-FROM transcripts AS T
-ANTI JOIN enhancers AS E
-ON
-    T.chrom = E.chrom
-    AND ABS(T.tss - (E.start+E.end)//2) < 1000
-"""
-    ).pl()
+def anchors_by_cre(
+        anchors: pl.DataFrame | pl.LazyFrame,
+        enhancers: pl.DataFrame | pl.LazyFrame,
+        transcript_quant: pl.DataFrame | pl.LazyFrame,
+        enhancer_index: PositionIndex = None
+    ) -> dict[str, pl.DataFrame]:
+    # Only these columns are read when the inputs are scans
+    anchors = anchors.lazy().collect()
+    enhancers = enhancers.lazy().select("chrom", "center").collect()
+    transcripts = transcript_quant.lazy().select("transcript_id", "chrom", "tss").collect()
+
+    # Count enhancers within 1kb of every transcript TSS and anchor center
+    transcript_enhancers = genomic_polars.count_within(
+        transcripts, enhancers, "tss", "center", [1000], index=enhancer_index
+    )
+    anchor_enhancers = genomic_polars.count_within(
+        anchors, enhancers, "center", "center", [1000], index=enhancer_index
+    )
+
+    # Get all transcripts that are distal (>1kb) from the nearest enhancer
+    transcripts_enhancer_distal = (
+        transcript_enhancers.filter(pl.col.n_within_1000 == 0).drop("n_within_1000")
+    )
     # Get all anchors that are distal (>1kb) from the nearest enhancer
-    anchors_enhancer_distal = conn.execute(
-"""
-SELECT *
-FROM anchors AS A
-ANTI JOIN enhancers AS E
-ON
-    A.chrom = E.chrom
-    AND ABS((A.start+A.end)//2 - (E.start+E.end)//2) < 1000
-"""
-    ).pl()
-    anchors_enhancer_distal.write_parquet("output/data/anchors_enhancer_distal.parquet")
+    anchors_enhancer_distal = (
+        anchor_enhancers.filter(pl.col.n_within_1000 == 0).drop("n_within_1000")
+    )
 
     # Get all combinations of transcripts and proximal (<1kb) enhancer-distal anchors
     # We expect that transcripts that don't have a local enhancer are more
     # dependent on looping interactions to bring an enhancer nearby.
-    anchors_enhancer_distal_by_transcript = conn.execute(
-"""
-SELECT
-    T.transcript_id AS transcript_id,
-    A.anchor_id,
-    A.loop_id
-FROM transcripts_enhancer_distal AS T
-JOIN anchors_enhancer_distal AS A
-ON
-    T.chrom = A.chrom
-    AND ABS(T.tss - (A.start+A.end)//2) < 1000
-"""
-    ).pl()
-    anchors_enhancer_distal_by_transcript.write_parquet("output/data/anchors_enhancer_distal_by_transcript.parquet")
-    with pl.Config(set_tbl_cols=-1):
-        print(anchors_enhancer_distal_by_transcript)
+    anchors_enhancer_distal_by_transcript = (
+        genomic_polars.window_join(
+            transcripts_enhancer_distal.select("transcript_id", "chrom", "tss"),
+            anchors_enhancer_distal.select("anchor_id", "loop_id", "chrom", "center"),
+            ["tss"], 
+            ["center"], 
+            1000
+        )
+        .select("transcript_id", "anchor_id", "loop_id")
+    )
 
-    # Get all combinations of enhancers and anchors
-    anchors_by_enhancer = conn.execute(
-"""
-SELECT DISTINCT
-    A.anchor_id,
-    A.loop_id
-FROM enhancers AS E
-JOIN anchors AS A
-ON
-    E.chrom = A.chrom
-    AND ABS((E.start+E.end)//2 - (A.start+A.end)//2) < 1000
-"""
-    ).pl()
-    anchors_by_enhancer.write_parquet("output/data/anchors_by_enhancer.parquet")
-    with pl.Config(set_tbl_cols=-1):
-        print(anchors_by_enhancer)
+    # Get all anchors with a proximal (<1kb) enhancer
+    anchors_by_enhancer = (
+        anchor_enhancers
+        .filter(pl.col.n_within_1000 > 0)
+        .select("anchor_id", "loop_id")
+    )
+
+    with duckdb.connect() as conn:
+        conn.register("anchors", anchors)
+        conn.register("anchors_enhancer_distal_by_transcript", anchors_enhancer_distal_by_transcript)
+        conn.register("anchors_by_enhancer", anchors_by_enhancer)
 
-    # Identify all transcripts and enhancers that are linked via a loop
-    # where the transcript anchor does not have a proximal enhancer.
-    bridging_pe_loops = conn.execute(
+        # Identify all transcripts and enhancers that are linked via a loop
+        # where the transcript anchor does not have a proximal enhancer.
+        bridging_pe_loops = conn.execute(
 """
 SELECT
     T.loop_id,
@@ -82,14 +73,12 @@ ON
     T.loop_id = A.loop_id
     AND T.anchor_id != A.anchor_id
 """
-    ).pl()
-    bridging_pe_loops.write_parquet("output/data/bridging_pe_loops.parquet")
-    with pl.Config(set_tbl_cols=-1):
-        print(bridging_pe_loops)
-    
-    # Identify all loops that transcripts lacking a nearby enhancer
-    # participate in.
-    transcript_loops = conn.execute(
+        ).pl()
+        conn.register("bridging_pe_loops", bridging_pe_loops)
+        
+        # Identify all loops that transcripts lacking a nearby enhancer
+        # participate in.
+        transcript_loops = conn.execute(
 """
 SELECT
     T.loop_id,
@@ -101,15 +90,13 @@ ON
     T.loop_id = A.loop_id
     AND T.anchor_id != A.anchor_id
 """
-    ).pl()
-    transcript_loops.write_parquet("output/data/transcript_loops.parquet")
-    with pl.Config(set_tbl_cols=-1):
-        print(transcript_loops)
+        ).pl()
+        conn.register("transcript_loops", transcript_loops)
 
-    # For ALL transcripts participating in at least one loop (bridging PE or not)
-    # count the number of loops and the number of bridging PE loops
-    # they participate in.
-    transcript_pe_loop_counts = conn.execute(
+        # For ALL transcripts participating in at least one loop (bridging PE or not)
+        # count the number of loops and the number of bridging PE loops
+        # they participate in.
+        transcript_pe_loop_counts = conn.execute(
 """
 WITH
 PE_count AS (
@@ -134,10 +121,29 @@ FROM L_count
 LEFT JOIN PE_count
     ON L_count.transcript_id = PE_count.transcript_id
 """
-    ).pl()
-    transcript_pe_loop_counts.write_parquet("output/data/transcript_pe_loop_counts.parquet")
-    with pl.Config(set_tbl_cols=-1):
-        print(transcript_pe_loop_counts)
+        ).pl()
+
+    return {
+        "anchors_enhancer_distal": anchors_enhancer_distal,
+        "anchors_enhancer_distal_by_transcript": anchors_enhancer_distal_by_transcript,
+        "anchors_by_enhancer": anchors_by_enhancer,
+        "bridging_pe_loops": bridging_pe_loops,
+        "transcript_loops": transcript_loops,
+        "transcript_pe_loop_counts": transcript_pe_loop_counts,
+    }
+
+if __name__ == "__main__":
+    tables = anchors_by_cre(
+        anchors=pl.scan_parquet("output/data/anchors.parquet"),
+        enhancers=pl.scan_parquet("output/data/enhancers.parquet"),
+        transcript_quant=pl.scan_parquet("output/data/transcript_quant.parquet"),
+        enhancer_index=PositionIndex.load("output/data/enhancers.parquet", ["center"]),
+    )
+    for name, table in tables.items():
+        write_table(table, f"output/data/{name}.parquet")
+        if name != "anchors_enhancer_distal":
+            with pl.Config(set_tbl_cols=-1):
+                print(table)
 
 
 # %%
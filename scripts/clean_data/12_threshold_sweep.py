@@ -0,0 +1,111 @@
+#%%
+import numpy as np
+import polars as pl
+from params import ThresholdSweep, ProxFlag, LoopCohesinCategoryAbbr, LoopRegulatoryCategoryAbbr
+from common.tables import write_table
+
+# Sensitivity of loop categories to the proximity thresholds of 08.
+# 1. Rank each anchor's nn_dist_* against the sorted threshold grids
+#    (an anchor is proximal at every threshold from its rank on)
+# 2. Look up regulation for each (enhancer, promoter) threshold pair and
+#    cohesin for each cohesin threshold, as in 09
+# 3. Count loops per (regulation, cohesin) for every threshold combination
+#    with one matrix product per category pair
+
+def grid_ranks(dist: pl.Series, grid: np.ndarray) -> np.ndarray:
+    "Index of the smallest threshold >= dist (len(grid) if none, or if dist is null)"
+    ranks = np.searchsorted(grid, dist.fill_null(np.iinfo(np.int64).max).to_numpy(), side="left")
+    return ranks.astype(np.int64)
+
+def category_codes(label_cls, mask1: np.ndarray, mask2: np.ndarray) -> np.ndarray:
+    "Physical Enum codes of label_cls.category for arrays of anchor masks"
+    table = ProxFlag.table(label_cls.category, label_cls.dtype).to_physical().to_numpy()
+    return table[mask1.astype(np.int64) + mask2.astype(np.int64) * (1 << ProxFlag.bits)]
+
+def enum_series(codes: np.ndarray, dtype: pl.Enum) -> pl.Series:
+    "Enum Series from physical category codes"
+    return pl.Series(np.array(dtype.categories.to_list())[codes], dtype=dtype)
+
+def threshold_sweep(
+        anchor_neighbors: pl.DataFrame | pl.LazyFrame,
+        enhancer_bp: list[int] = ThresholdSweep.enhancer,
+        promoter_bp: list[int] = ThresholdSweep.promoter,
+        cohesin_bp: list[int] = ThresholdSweep.cohesin,
+        labels: bool = ThresholdSweep.write_labels
+    ) -> dict[str, pl.DataFrame]:
+    anchors = (
+        anchor_neighbors.lazy()
+        .select("loop_id", "anchor", "nn_dist_enh", "nn_dist_tss", "nn_dist_coh")
+        .collect()
+    )
+    loops = (
+        anchors.filter(pl.col.anchor == 1).drop("anchor")
+        .join(anchors.filter(pl.col.anchor == 2).drop("anchor"), on="loop_id", suffix="2")
+        .sort("loop_id")
+    )
+    enh_grid, pro_grid, coh_grid = (np.unique(grid) for grid in [enhancer_bp, promoter_bp, cohesin_bp])
+    n_enh, n_pro, n_coh = len(enh_grid), len(pro_grid), len(coh_grid)
+
+    # Proximal flags of shape (loops, thresholds) for each anchor
+    def proximal(col, grid):
+        return grid_ranks(loops[col], grid)[:, None] <= np.arange(len(grid))[None, :]
+    enh1, enh2 = proximal("nn_dist_enh", enh_grid), proximal("nn_dist_enh2", enh_grid)
+    pro1, pro2 = proximal("nn_dist_tss", pro_grid), proximal("nn_dist_tss2", pro_grid)
+    coh1, coh2 = proximal("nn_dist_coh", coh_grid), proximal("nn_dist_coh2", coh_grid)
+
+    # Regulation: (loops, enhancer thresholds, promoter thresholds)
+    mask1 = enh1[:, :, None] * ProxFlag.enh + pro1[:, None, :] * ProxFlag.pro
+    mask2 = enh2[:, :, None] * ProxFlag.enh + pro2[:, None, :] * ProxFlag.pro
+    regulation = category_codes(LoopRegulatoryCategoryAbbr, mask1, mask2)
+    # Cohesin: (loops, cohesin thresholds)
+    cohesin = category_codes(LoopCohesinCategoryAbbr, coh1 * ProxFlag.coh, coh2 * ProxFlag.coh)
+
+    reg_categories = LoopRegulatoryCategoryAbbr.dtype.categories.to_list()
+    coh_categories = LoopCohesinCategoryAbbr.dtype.categories.to_list()
+    # counts[e, p, c, r, k] = loops with regulation r and cohesin k
+    counts = np.empty((n_enh, n_pro, n_coh, len(reg_categories), len(coh_categories)), dtype=np.int64)
+    for r in range(len(reg_categories)):
+        is_reg = (regulation == r).reshape(len(loops), n_enh * n_pro).astype(np.float64)
+        for k in range(len(coh_categories)):
+            is_coh = (cohesin == k).astype(np.float64)
+            counts[:, :, :, r, k] = np.rint(is_reg.T @ is_coh).reshape(n_enh, n_pro, n_coh)
+
+    e, p, c, r, k = np.indices(counts.shape).reshape(5, -1)
+    sweep_counts = pl.DataFrame({
+        "enhancer_bp": enh_grid[e],
+        "promoter_bp": pro_grid[p],
+        "cohesin_bp": coh_grid[c],
+        "regulation": enum_series(r, LoopRegulatoryCategoryAbbr.dtype),
+        "cohesin": enum_series(k, LoopCohesinCategoryAbbr.dtype),
+        "n_loops": counts.reshape(-1),
+    })
+    result = {"threshold_sweep_counts": sweep_counts}
+
+    if labels:
+        # Regulation and cohesin depend on disjoint thresholds, so they are
+        # labeled separately rather than for every full combination
+        loop_id = loops["loop_id"].to_numpy()
+        l, e, p = np.indices(regulation.shape).reshape(3, -1)
+        result["threshold_sweep_regulation"] = pl.DataFrame({
+            "loop_id": loop_id[l],
+            "enhancer_bp": enh_grid[e],
+            "promoter_bp": pro_grid[p],
+            "regulation": enum_series(regulation.reshape(-1), LoopRegulatoryCategoryAbbr.dtype),
+        })
+        l, c = np.indices(cohesin.shape).reshape(2, -1)
+        result["threshold_sweep_cohesin"] = pl.DataFrame({
+            "loop_id": loop_id[l],
+            "cohesin_bp": coh_grid[c],
+            "cohesin": enum_series(cohesin.reshape(-1), LoopCohesinCategoryAbbr.dtype),
+        })
+    return result
+
+if __name__ == "__main__":
+    tables = threshold_sweep(
+        anchor_neighbors=pl.scan_parquet("output/data/anchor_neighbors.parquet")
+    )
+    with pl.Config(set_tbl_cols=-1):
+        print(tables["threshold_sweep_counts"])
+    for name, table in tables.items():
+        write_table(table, f"output/data/{name}.parquet")
+# %%
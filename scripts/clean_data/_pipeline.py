@@ -0,0 +1,396 @@
+"""
+Run the clean_data steps, re-executing only those whose inputs changed.
+
+Each step declares its input and output files and the params.py classes it
+depends on. A step's stamp hashes its script, its inputs' contents and the
+source of those params classes. A step re-runs when its stamp differs from
+the one recorded at its last successful run, or when an output is missing.
+Steps whose dependencies are complete run concurrently.
+
+    python _pipeline.py                 # run stale steps
+    python _pipeline.py --dry-run       # list stale steps
+    python _pipeline.py --force 08_anchor_categories
+    python _pipeline.py 09_loop_categories   # only this step and its upstream
+    python _pipeline.py --in-memory --write loop_categories
+
+With --in-memory, the selected steps' functions are chained in this process.
+Intermediate frames stay in memory; only frames named by --write are saved
+to output/data, and stamps are left untouched. Naming a step with non-table
+outputs (e.g. 10_fen1_fads_locus_b_loops's browser tracks) in --write also
+writes those.
+"""
+import argparse
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from pathlib import Path
+import polars as pl
+import params
+from common.cache import content_hash
+from common.tables import write_table
+
+@dataclass
+class Step:
+    name: str
+    func: str
+    inputs: list[str]
+    outputs: list[str]
+    params: list[str] = field(default_factory=list)
+    # Function writing the step's non-table outputs from its frames, if any
+    writer: str = None
+
+    @property
+    def script(self) -> str:
+        return f"{self.name}.py"
+
+GENOMIC_POLARS = ["common/genomic_polars.py", "common/position_index.py", "common/cache.py"]
+# Steps writing to output/data depend on the table writer's layout
+TABLES = ["common/tables.py"]
+
+STEPS = [
+    Step(
+        "01_extract_loops",
+        func="extract_loops",
+        inputs=["raw/Loops/localizedList_primary_10.bedpe", *TABLES],
+        outputs=["output/data/loops.parquet"],
+    ),
+    Step(
+        "02_extract_anchors",
+        func="extract_anchors",
+        inputs=["output/data/loops.parquet", *TABLES],
+        outputs=["output/data/anchors.parquet"],
+    ),
+    Step(
+        "03_extract_transcript_annots",
+        func="extract_transcript_annots",
+        inputs=["raw/Genes/gencode.v49.annotation.gtf.gz", "common/gtf.py", "common/cache.py", *TABLES],
+        outputs=[
+            "output/data/gene_annot.parquet",
+            "output/data/transcript_annot.parquet",
+            "output/data/exon_annot.parquet",
+        ],
+    ),
+    Step(
+        "04_extract_transcript_quant",
+        func="extract_transcript_quant",
+        inputs=[
+            "raw/RNA/quant/transcript_quant_rep1_ENCFF190NFH.tsv",
+            "raw/RNA/quant/transcript_quant_rep2_ENCFF461FLA.tsv",
+            "output/data/transcript_annot.parquet",
+            "common/quant.py",
+            *TABLES,
+        ],
+        outputs=["output/data/transcript_quant.parquet"],
+    ),
+    Step(
+        "05_extract_enhancers",
+        func="extract_enhancers",
+        inputs=["raw/Kuei_enhancers/region.annotation.fcc_starrmpra.group.2025.08.22.tsv", *TABLES],
+        outputs=["output/data/enhancers.parquet"],
+    ),
+    Step(
+        "06_extract_peaks",
+        func="extract_peaks",
+        inputs=[
+            "raw/TF_ChIP/pooled_cons_IDR_peaks/CTCF_ENCFF901CBP.bed.gz",
+            "raw/TF_ChIP/pooled_cons_IDR_peaks/RAD21_ENCFF439DYW.bed.gz",
+            "raw/TF_ChIP/pooled_cons_IDR_peaks/SMC3_ENCFF289LLT.bed.gz",
+            *GENOMIC_POLARS,
+            *TABLES,
+        ],
+        outputs=[
+            "output/data/CTCF.parquet",
+            "output/data/RAD21.parquet",
+            "output/data/SMC3.parquet",
+            "output/data/cohesin.parquet",
+        ],
+    ),
+    Step(
+        "07_anchor_neighbors",
+        func="anchor_neighbors",
+        inputs=[
+            "output/data/anchors.parquet",
+            "output/data/enhancers.parquet",
+            "output/data/transcript_quant.parquet",
+            "output/data/cohesin.parquet",
+            *GENOMIC_POLARS,
+            *TABLES,
+        ],
+        outputs=["output/data/anchor_neighbors.parquet"],
+    ),
+    Step(
+        "08_anchor_categories",
+        func="anchor_categories",
+        inputs=["output/data/anchor_neighbors.parquet", *TABLES],
+        outputs=["output/data/anchor_categories.parquet"],
+        params=["BPThresholds", "ProxFlag"],
+    ),
+    Step(
+        "09_loop_categories",
+        func="loop_categories",
+        inputs=["output/data/anchor_categories.parquet", *TABLES],
+        outputs=["output/data/loop_categories.parquet"],
+        params=["ProxFlag", "LoopCohesinCategoryAbbr", "LoopRegulatoryCategoryAbbr"],
+    ),
+    Step(
+        "10_fen1_fads_locus_b_loops",
+        func="fen1_fads_locus_b_loops",
+        writer="write_browser_tracks",
+        inputs=[
+            "output/data/anchors.parquet",
+            "output/data/enhancers.parquet",
+            "output/data/transcript_quant.parquet",
+            "raw/Reference/hg38.chrom.sizes",
+            "output/browser_tracks/interact.as",
+            *GENOMIC_POLARS,
+        ],
+        outputs=[
+            "output/browser_tracks/mass_screen_enhancers.bed",
+            "output/browser_tracks/mass_screen_enhancers.bb",
+            "output/browser_tracks/transcript_ids.txt",
+            "output/browser_tracks/bridging_pe_loops.interact",
+            "output/browser_tracks/bridging_pe_loops.bb",
+        ],
+    ),
+    Step(
+        "11_anchors_by_cre",
+        func="anchors_by_cre",
+        inputs=[
+            "output/data/anchors.parquet",
+            "output/data/enhancers.parquet",
+            "output/data/transcript_quant.parquet",
+            *GENOMIC_POLARS,
+            *TABLES,
+        ],
+        outputs=[
+            "output/data/anchors_enhancer_distal.parquet",
+            "output/data/anchors_enhancer_distal_by_transcript.parquet",
+            "output/data/anchors_by_enhancer.parquet",
+            "output/data/bridging_pe_loops.parquet",
+            "output/data/transcript_loops.parquet",
+            "output/data/transcript_pe_loop_counts.parquet",
+        ],
+    ),
+    Step(
+        "12_threshold_sweep",
+        func="threshold_sweep",
+        inputs=["output/data/anchor_neighbors.parquet", *TABLES],
+        # Per-loop label tables are also written when ThresholdSweep.write_labels is set
+        outputs=["output/data/threshold_sweep_counts.parquet"],
+        params=["ThresholdSweep", "ProxFlag", "LoopCohesinCategoryAbbr", "LoopRegulatoryCategoryAbbr"],
+    ),
+]
+
+DATA_DIR = Path("output/data")
+STATE_PATH = DATA_DIR / ".pipeline_state.json"
+LOG_DIR = Path("output/logs")
+
+def stat_signature(path: str) -> dict:
+    "Size and mtime of a file, or totals over the files in a partitioned dataset"
+    path = Path(path)
+    files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+    stats = [os.stat(file) for file in files]
+    return {
+        "files": len(stats),
+        "size": sum(stat.st_size for stat in stats),
+        "mtime_ns": max((stat.st_mtime_ns for stat in stats), default=0),
+    }
+
+class PipelineState:
+    """
+    Stamps of successful step runs, plus a cache of file hashes.
+
+    File hashes are reused while a file's size and mtime are unchanged, so
+    large raw inputs are only re-hashed when they are replaced. Directory
+    datasets are compared by their files' count, total size and latest mtime.
+    """
+    def __init__(self, path: Path = STATE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        state = json.loads(path.read_text()) if path.exists() else {}
+        self.stamps: dict[str, str] = state.get("stamps", {})
+        self.files: dict[str, dict] = state.get("files", {})
+
+    def file_hash(self, path: str) -> str:
+        signature = stat_signature(path)
+        with self.lock:
+            cached = self.files.get(path)
+        if cached and cached.get("signature") == signature:
+            return cached["hash"]
+        digest = content_hash(path)
+        with self.lock:
+            self.files[path] = {"signature": signature, "hash": digest}
+        return digest
+
+    def set_stamp(self, step: Step, stamp: str):
+        with self.lock:
+            self.stamps[step.name] = stamp
+            self.save()
+
+    def save(self):
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps({"stamps": self.stamps, "files": self.files}, indent=1))
+        tmp_path.replace(self.path)
+
+def stamp(step: Step, state: PipelineState) -> str:
+    "Hash of the step's script, input contents and params sources"
+    digest = hashlib.sha256()
+    for path in [step.script, *step.inputs]:
+        digest.update(path.encode())
+        digest.update(state.file_hash(path).encode())
+    for name in step.params:
+        digest.update(inspect.getsource(getattr(params, name)).encode())
+    return digest.hexdigest()
+
+def upstream(steps: list[Step]) -> dict[str, set[str]]:
+    "Names of the steps producing each step's inputs"
+    producers = {output: step.name for step in steps for output in step.outputs}
+    return {
+        step.name: {producers[path] for path in step.inputs if path in producers}
+        for step in steps
+    }
+
+def select_steps(steps: list[Step], targets: list[str]) -> list[Step]:
+    "targets and everything upstream of them, or all steps if no targets"
+    if not targets:
+        return steps
+    deps = upstream(steps)
+    selected, pending = set(), list(targets)
+    while pending:
+        name = pending.pop()
+        assert name in deps, f"Unknown step '{name}'"
+        if name not in selected:
+            selected.add(name)
+            pending.extend(deps[name])
+    return [step for step in steps if step.name in selected]
+
+def is_stale(step: Step, state: PipelineState, force: set[str]) -> tuple[bool, str]:
+    "Whether step must run, and its current stamp"
+    current = stamp(step, state)
+    missing_output = not all(Path(output).exists() for output in step.outputs)
+    stale = step.name in force or missing_output or state.stamps.get(step.name) != current
+    return stale, current
+
+def run_step(step: Step, state: PipelineState, force: set[str], dry_run: bool) -> str:
+    "Run step if stale, returning 'ran', 'stale' (dry run) or 'fresh'"
+    if dry_run and step.name in force:
+        # Inputs may not exist yet if an upstream step would have made them
+        return "stale"
+    stale, current = is_stale(step, state, force)
+    if not stale:
+        return "fresh"
+    if dry_run:
+        return "stale"
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    with open(LOG_DIR / f"{step.name}.log", "w") as log:
+        subprocess.run(
+            [sys.executable, step.script],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            check=True
+        )
+    # Outputs changed, so their hashes are recomputed by downstream stamps
+    state.set_stamp(step, current)
+    return "ran"
+
+def run(steps: list[Step], jobs: int, force: set[str], dry_run: bool):
+    "Run steps in dependency order, with up to 'jobs' independent steps at once"
+    state = PipelineState()
+    deps = upstream(steps)
+    names = {step.name for step in steps}
+    done, failed, running = set(), set(), {}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while len(done) + len(failed) < len(steps):
+            for step in steps:
+                waiting_on = deps[step.name] & names
+                ready = waiting_on <= done
+                if step.name not in done | failed | set(running.values()) and ready:
+                    future = pool.submit(run_step, step, state, force, dry_run)
+                    running[future] = step.name
+
+            # Skip everything downstream of a failure
+            for step in steps:
+                blocked = deps[step.name] & failed
+                if blocked and step.name not in failed:
+                    print(f"{step.name}: skipped, upstream failed", flush=True)
+                    failed.add(step.name)
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    status = future.result()
+                    # In a dry run, stale steps' dependents are treated as stale too
+                    if dry_run and status == "stale":
+                        force.update(
+                            step.name for step in steps if name in deps[step.name]
+                        )
+                    print(f"{name}: {status}", flush=True)
+                    done.add(name)
+                except subprocess.CalledProcessError:
+                    print(f"{name}: failed, see {LOG_DIR / (name + '.log')}", flush=True)
+                    failed.add(name)
+                except OSError as e:
+                    print(f"{name}: failed, {e}", flush=True)
+                    failed.add(name)
+    if failed:
+        sys.exit(1)
+
+def run_in_memory(steps: list[Step], write: list[str]):
+    """
+    Chain the step functions in this process, writing only the 'write' frames.
+
+    Each step function takes its parquet inputs as keyword arguments named
+    after their stems. Frames not produced by an earlier step are passed as
+    lazy scans of output/data, so steps read only the columns and rows they use.
+    Steps named in 'write' also have their writer called on their frames.
+    """
+    frames: dict[str, pl.DataFrame | pl.LazyFrame] = {}
+    for step in steps:
+        func = getattr(importlib.import_module(step.name), step.func)
+        accepted = inspect.signature(func).parameters
+        kwargs = {}
+        for path in map(Path, step.inputs):
+            if path.parent != DATA_DIR or path.suffix != ".parquet" or path.stem not in accepted:
+                continue
+            if path.stem not in frames:
+                frames[path.stem] = pl.scan_parquet(path)
+            kwargs[path.stem] = frames[path.stem]
+        print(f"{step.name}: running in memory", flush=True)
+        step_frames = func(**kwargs)
+        frames.update(step_frames)
+        if step.name in write:
+            assert step.writer, f"Step '{step.name}' has no outputs besides its frames"
+            getattr(importlib.import_module(step.name), step.writer)(**step_frames)
+            print(f"Wrote {', '.join(step.outputs)}", flush=True)
+
+    step_names = {step.name for step in steps}
+    for name in write:
+        if name in step_names:
+            continue
+        assert name in frames, f"No step produced '{name}', available: {sorted(frames)}"
+        write_table(frames[name].lazy().collect(), DATA_DIR / f"{name}.parquet")
+        print(f"Wrote {DATA_DIR / name}.parquet", flush=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("targets", nargs="*", help="Steps to bring up to date (default: all)")
+    parser.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="Max steps run at once")
+    parser.add_argument("--force", nargs="*", default=[], help="Steps to run even if fresh")
+    parser.add_argument("--dry-run", action="store_true", help="Only report which steps are stale")
+    parser.add_argument("--in-memory", action="store_true", help="Chain steps in this process without writing intermediates")
+    parser.add_argument("--write", nargs="*", default=[], help="Frames, or steps with non-table outputs, to save in --in-memory mode")
+    args = parser.parse_args()
+    if args.in_memory:
+        run_in_memory(select_steps(STEPS, args.targets), args.write)
+        sys.exit()
+    run(select_steps(STEPS, args.targets), args.jobs, set(args.force), args.dry_run)
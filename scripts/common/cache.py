@@ -0,0 +1,20 @@
+import hashlib
+from pathlib import Path
+
+def content_hash(path: str | Path, chunk_size: int = 1 << 20) -> str:
+    """
+    SHA-256 hex digest of a file's contents.
+
+    Directories (e.g. partitioned parquet datasets) are hashed over the
+    relative paths and contents of all files beneath them, in sorted order.
+    """
+    path = Path(path)
+    digest = hashlib.sha256()
+    files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+    for file in files:
+        if path.is_dir():
+            digest.update(str(file.relative_to(path)).encode())
+        with open(file, "rb") as f:
+            while chunk := f.read(chunk_size):
+                digest.update(chunk)
+    return digest.hexdigest()
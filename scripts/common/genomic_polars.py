@@ -9,36 +9,474 @@ from typing import Callable, Dict, Any
 from scipy.spatial import KDTree
 from functools import partial
 from warnings import warn
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from common.position_index import PositionIndex
 
 def partition_overlaps(
         func: Callable, 
-        df1: pl.DataFrame, 
-        df2: pl.DataFrame, 
+        df1: pl.DataFrame | pl.LazyFrame, 
+        df2: pl.DataFrame | pl.LazyFrame, 
         partition_by: list[str], 
         intersection: bool = True,
         concat: bool = True,
         a = None, 
-        kw = None
+        kw = None,
+        how: str = None,
+        executor: str = None,
+        n_workers: int = None,
+        key_kw: Callable[[tuple], Dict[str, Any]] = None
     ):
-    df1_p = df1.partition_by(partition_by, as_dict=True)
-    df2_p = df2.partition_by(partition_by, as_dict=True)
-    key_union = sorted(list(set(df1_p.keys()).union(set(df2_p.keys()))))
-    results = []
-    for key in key_union:
-        if (key in df1_p and key in df2_p) or not intersection:
-            results.append(
-                func(
-                    df1_p.get(key), 
-                    df2_p.get(key), 
-                    *(a or []), 
-                    **(kw or {})
-                )
-            )
+    """
+    Apply func(df1_part, df2_part, *a, **kw) to each partition key, in sorted key order.
+
+    key_kw(key) optionally returns extra kwargs for func on that key's partitions.
+
+    how selects the partition keys func is applied to:
+        "inner": keys present in both df1 and df2
+        "left": keys present in df1. Missing df2 partitions are passed as an
+            empty frame with df2's schema, so func can emit null results.
+        "outer": keys present in either. Missing partitions are passed as None.
+    If how is None, it is "inner" if intersection else "outer".
+
+    executor runs partitions serially (None) or on a "thread" or "process"
+    pool of n_workers. Results are returned in sorted key order either way.
+    For a "process" pool, func, a and kw must be picklable and the calling
+    script needs an `if __name__ == "__main__"` guard, since workers are spawned.
+
+    LazyFrame inputs are only scanned for their keys up front. Each partition
+    is collected when its task runs.
+    """
+    how = how or ("inner" if intersection else "outer")
+    assert how in ("inner", "left", "outer"), (
+        f"how is '{how}', must be one of 'inner', 'left', 'outer'"
+    )
+    df1_p = _partitions(df1, partition_by)
+    df2_p = _partitions(df2, partition_by)
+    if how == "inner":
+        keys = set(df1_p.keys()).intersection(df2_p.keys())
+    elif how == "left":
+        keys = set(df1_p.keys())
+    else:
+        keys = set(df1_p.keys()).union(df2_p.keys())
+    df2_missing = df2.clear() if how == "left" else None
+    tasks = [
+        (
+            func, 
+            df1_p.get(key), 
+            df2_p.get(key, df2_missing), 
+            a or [], 
+            {**(kw or {}), **(key_kw(key) if key_kw else {})}
+        )
+        for key in sorted(keys)
+    ]
+    results = _map_partitions(_apply_partition, tasks, executor, n_workers)
     if concat:
         return pl.concat(results)
     else:
         return results
 
+def _partitions(
+        df: pl.DataFrame | pl.LazyFrame, 
+        partition_by: list[str]
+    ) -> Dict[tuple, pl.DataFrame | pl.LazyFrame]:
+    """
+    Split df by partition_by keys.
+
+    DataFrames are partitioned eagerly. LazyFrames only have their distinct
+    keys collected, and map to a filtered LazyFrame per key.
+    """
+    if isinstance(df, pl.DataFrame):
+        return df.partition_by(partition_by, as_dict=True)
+    keys = df.select(partition_by).unique().collect().rows()
+    return {
+        key: df.filter(*[
+            pl.col(col) == pl.lit(value) 
+            for col, value in zip(partition_by, key)
+        ])
+        for key in keys
+    }
+
+def _apply_partition(func, df1, df2, a, kw):
+    "Collect lazy partitions, then apply func"
+    if isinstance(df1, pl.LazyFrame):
+        df1 = df1.collect()
+    if isinstance(df2, pl.LazyFrame):
+        df2 = df2.collect()
+    return func(df1, df2, *a, **kw)
+
+def _map_partitions(
+        task: Callable, 
+        args: list[tuple], 
+        executor: str = None, 
+        n_workers: int = None
+    ) -> list:
+    "Run task(*arg) for each arg serially or on a pool, returning results in order"
+    assert executor in (None, "thread", "process"), (
+        f"executor is '{executor}', must be one of None, 'thread', 'process'"
+    )
+    if executor is None or len(args) <= 1:
+        return [task(*arg) for arg in args]
+    if executor == "thread":
+        pool = ThreadPoolExecutor(max_workers=n_workers)
+    else:
+        # Forking a process that has started polars' thread pool can deadlock
+        pool = ProcessPoolExecutor(
+            max_workers=n_workers, 
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    with pool:
+        # map yields results in submission order regardless of completion order
+        return list(pool.map(task, *zip(*args)))
+
+def window_join(
+        df1: pl.DataFrame | pl.LazyFrame, 
+        df2: pl.DataFrame | pl.LazyFrame, 
+        left_on: list[str], 
+        right_on: list[str], 
+        distance: int = 0,
+        how: str = "inner",
+        partition_by: list[str] = ["chrom"],
+        suffix: str = "_right",
+        executor: str = None,
+        n_workers: int = None,
+        index: PositionIndex = None
+    ) -> pl.DataFrame:
+    """
+    Join rows of df1 and df2 whose positions are within distance of each other.
+
+    left_on and right_on are either [position] or [start, end] columns. Rows
+    match if the gap between them is less than distance, where
+    gap = max(start2 - end1, start1 - end2). So for positions this is
+    abs(pos1 - pos2) < distance, and for half-open intervals with distance=0
+    it is overlap.
+
+    how:
+        "inner": all matching pairs, df2 columns suffixed on name collisions
+        "semi": rows of df1 with at least one match
+        "anti": rows of df1 with no match
+    Pairs are found per partition by a sweep over df2 sorted by start.
+    index is an optional PositionIndex of df2's right_on columns that
+    replaces sorting df2.
+    """
+    assert how in ("inner", "semi", "anti"), (
+        f"how is '{how}', must be one of 'inner', 'semi', 'anti'"
+    )
+    assert len(left_on) in (1, 2) and len(right_on) in (1, 2), (
+        "left_on and right_on must be [position] or [start, end]"
+    )
+    kw = {
+        "left_on": left_on, 
+        "right_on": right_on, 
+        "distance": distance, 
+        "how": how, 
+        "partition_by": partition_by, 
+        "suffix": suffix
+    }
+    results = partition_overlaps(
+        _window_join_partition, 
+        df1, 
+        df2, 
+        partition_by, 
+        # Anti joins keep df1 rows on partitions without any df2 rows
+        how="left" if how == "anti" else "inner",
+        concat=False,
+        kw=kw,
+        executor=executor,
+        n_workers=n_workers,
+        key_kw=(lambda key: {"sorted2": index.get(key)}) if index else None
+    )
+    if not results:
+        # No shared partitions, so produce an empty frame with the output schema
+        return _window_join_partition(
+            df1.clear().lazy().collect(), 
+            df2.clear().lazy().collect(), 
+            **kw
+        )
+    return pl.concat(results)
+
+def _window_join_partition(
+        df1: pl.DataFrame, 
+        df2: pl.DataFrame, 
+        left_on: list[str], 
+        right_on: list[str], 
+        distance: int, 
+        how: str, 
+        partition_by: list[str], 
+        suffix: str,
+        sorted2: Dict[str, np.ndarray] = None
+    ) -> pl.DataFrame:
+    "window_join on a single partition"
+    start1 = df1[left_on[0]].to_numpy()
+    end1 = df1[left_on[-1]].to_numpy()
+    start2 = df2[right_on[0]].to_numpy()
+    end2 = df2[right_on[-1]].to_numpy()
+    if sorted2 is not None:
+        assert len(sorted2["order"]) == df2.height, (
+            "index does not match df2 partition, which must be unfiltered"
+        )
+    idx1, idx2 = _window_pairs(start1, end1, start2, end2, distance, sorted2)
+
+    if how != "inner":
+        has_match = np.zeros(df1.height, dtype=bool)
+        has_match[idx1] = True
+        return df1.filter(has_match if how == "semi" else ~has_match)
+
+    # Gather matching rows from each side, suffixing df2 name collisions
+    right = (
+        df2
+        .drop(partition_by)
+        .rename(lambda col: col + suffix if col in df1.columns else col)
+    )
+    return pl.concat(
+        [df1[pl.Series(idx1)], right[pl.Series(idx2)]], 
+        how="horizontal"
+    )
+
+def _window_pairs(
+        start1: np.ndarray, 
+        end1: np.ndarray, 
+        start2: np.ndarray, 
+        end2: np.ndarray, 
+        distance: int,
+        sorted2: Dict[str, np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find all (i, j) with max(start2[j] - end1[i], start1[i] - end2[j]) < distance.
+
+    sorted2 optionally holds start2 pre-sorted, as stored by PositionIndex.
+    Returns index arrays ordered by i, then by start2.
+    """
+    start1 = start1.astype(np.int64)
+    end1 = end1.astype(np.int64)
+    if sorted2 is None:
+        order = np.argsort(start2, kind="stable")
+        sorted_start2 = start2[order].astype(np.int64)
+        sorted_end2 = end2[order].astype(np.int64)
+    else:
+        order = sorted2["order"]
+        sorted_start2 = sorted2["start"]
+        sorted_end2 = sorted2.get("end", sorted_start2)
+    if len(order) == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty
+    max_len = int((sorted_end2 - sorted_start2).max())
+
+    # 1. Candidates start before end1 + distance, and can only reach
+    #    start1 - distance if they start within max_len of it
+    hi = np.searchsorted(sorted_start2, end1 + distance, side="left")
+    lo = np.searchsorted(sorted_start2, start1 - distance - max_len, side="right")
+    counts = (hi - lo).clip(0)
+
+    # 2. Expand each [lo, hi) candidate range to one row per pair
+    idx1 = np.repeat(np.arange(len(start1)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(counts.cumsum() - counts, counts)
+    sorted_idx2 = np.repeat(lo, counts) + offsets
+
+    # 3. Drop candidates that end too far before start1
+    if max_len > 0:
+        keep = sorted_end2[sorted_idx2] > start1[idx1] - distance
+        idx1, sorted_idx2 = idx1[keep], sorted_idx2[keep]
+    return idx1, order[sorted_idx2]
+
+def count_within(
+        from_df: pl.DataFrame | pl.LazyFrame, 
+        to_df: pl.DataFrame | pl.LazyFrame, 
+        from_col: str, 
+        to_col: str, 
+        windows: list[int], 
+        weight_col: str = None,
+        count_col = r"n_within_{window}",
+        sum_col = r"{col}_within_{window}",
+        partition_by: list[str] = ["chrom"],
+        executor: str = None,
+        n_workers: int = None,
+        index: PositionIndex = None
+    ) -> pl.DataFrame:
+    """
+    Count to_df rows within each window of every from_df row.
+
+    A target is within window w of a row if abs(from_pos - to_pos) < w, on
+    the same partition. If weight_col is given, its sum over those targets
+    is added too. Counts and sums come from binary search and prefix sums
+    over the sorted targets, so no pairs are materialized. index is an
+    optional PositionIndex of to_df's to_col that replaces sorting to_df.
+    """
+    kw = {
+        "from_col": from_col, 
+        "to_col": to_col, 
+        "windows": windows, 
+        "weight_col": weight_col, 
+        "count_col": count_col, 
+        "sum_col": sum_col
+    }
+    results = partition_overlaps(
+        _count_within_partition, 
+        from_df, 
+        to_df, 
+        partition_by, 
+        # Rows on partitions without targets get zero counts
+        how="left",
+        concat=False,
+        kw=kw,
+        executor=executor,
+        n_workers=n_workers,
+        key_kw=(lambda key: {"to_index": index.sorted_positions(key)}) if index else None
+    )
+    if not results:
+        # No from_df rows, so produce an empty frame with the output schema
+        return _count_within_partition(
+            from_df.clear().lazy().collect(), 
+            to_df.clear().lazy().collect(), 
+            **kw
+        )
+    return pl.concat(results)
+
+def _count_within_partition(
+        from_df: pl.DataFrame, 
+        to_df: pl.DataFrame, 
+        from_col: str, 
+        to_col: str, 
+        windows: list[int], 
+        weight_col: str,
+        count_col: str,
+        sum_col: str,
+        to_index: Tuple[np.ndarray, np.ndarray] = None
+    ) -> pl.DataFrame:
+    "count_within on a single partition"
+    if to_index is None:
+        sorted_pos, order = _sorted_index(to_df[to_col].to_numpy())
+    else:
+        sorted_pos, order = to_index
+        assert len(order) == to_df.height, (
+            "index does not match to_df partition, which must be unfiltered"
+        )
+    from_pos = from_df[from_col].to_numpy().astype(np.int64)
+    if weight_col is not None:
+        weights = to_df[weight_col].fill_null(0).to_numpy()[order]
+        prefix = np.concatenate([[0], np.cumsum(weights)])
+
+    result_cols = []
+    for window in windows:
+        lo = np.searchsorted(sorted_pos, from_pos - window, side="right")
+        hi = np.searchsorted(sorted_pos, from_pos + window, side="left")
+        result_cols.append(
+            pl.Series(count_col.format(window=window), hi - lo, dtype=pl.Int64)
+        )
+        if weight_col is not None:
+            result_cols.append(pl.Series(
+                sum_col.format(col=weight_col, window=window), 
+                prefix[hi] - prefix[lo]
+            ))
+    return pl.concat([from_df, pl.DataFrame(result_cols)], how="horizontal")
+
+def merge_intervals(
+        df: pl.DataFrame, 
+        start_col: str = "start", 
+        end_col: str = "end", 
+        partition_by: list[str] = ["chrom"],
+        distance: int = 0,
+        source_col: str = None,
+        min_sources: int = 1,
+        aggs: list[pl.Expr] = []
+    ) -> pl.DataFrame:
+    """
+    Merge overlapping intervals into their union, like bedtools merge.
+
+    Intervals are sorted by start within each partition and a new merged
+    interval begins wherever start exceeds the running max of previous ends
+    by more than distance (so book-ended intervals merge at distance=0).
+    Merged rows hold partition_by, start_col, end_col, 'n_merged' and any
+    aggs, evaluated over each merged group (e.g. pl.col.id to keep a list).
+
+    If source_col is given, 'sources' lists the distinct sources in each
+    merged interval and only those supported by at least min_sources of
+    them are kept (k-of-n support).
+    """
+    prev_end = pl.col(end_col).cum_max().shift(1).over(partition_by)
+    new_group = (pl.col(start_col) > prev_end + distance).fill_null(True)
+    source_aggs = []
+    if source_col is not None:
+        source_aggs = [pl.col(source_col).unique().sort().alias("sources")]
+    merged = (
+        df
+        .sort(*partition_by, start_col, maintain_order=True)
+        .with_columns(_merge_group = new_group.cum_sum().over(partition_by))
+        .group_by(*partition_by, "_merge_group", maintain_order=True)
+        .agg(
+            pl.col(start_col).min(),
+            pl.col(end_col).max(),
+            pl.len().alias("n_merged"),
+            *source_aggs,
+            *aggs
+        )
+        .drop("_merge_group")
+    )
+    if source_col is not None:
+        merged = merged.filter(pl.col.sources.list.len() >= min_sources)
+    return merged
+
+def _sorted_index(to_pos: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sort 1-D positions for binary search.
+
+    Returns (sorted_pos, order) where sorted_pos = to_pos[order].
+    """
+    order = np.argsort(to_pos, kind="stable")
+    return to_pos[order], order
+
+def _query_sorted(
+        sorted_pos: np.ndarray, 
+        order: np.ndarray, 
+        from_pos: np.ndarray, 
+        k: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the k nearest sorted_pos to each of from_pos by binary search.
+
+    Returns int64 (dist, idx) arrays of shape (k, len(from_pos)) with idx
+    indexing the unsorted positions via 'order'. Neighbors that don't exist
+    (fewer than k targets) have dist and idx -1. Ties go to the lower position.
+    """
+    n = len(sorted_pos)
+    dist = np.full((k, len(from_pos)), -1, dtype=np.int64)
+    idx = np.full((k, len(from_pos)), -1, dtype=np.int64)
+    if n == 0:
+        return dist, idx
+    from_pos = from_pos.astype(np.int64)
+    sorted_pos = sorted_pos.astype(np.int64)
+    no_neighbor = np.iinfo(np.int64).max
+
+    # Candidates are the closest unused targets on either side of each query
+    right = np.searchsorted(sorted_pos, from_pos, side="left")
+    left = right - 1
+    for i in range(k):
+        left_dist = np.where(
+            left >= 0, 
+            from_pos - sorted_pos[left.clip(0, n-1)], 
+            no_neighbor
+        )
+        right_dist = np.where(
+            right < n, 
+            sorted_pos[right.clip(0, n-1)] - from_pos, 
+            no_neighbor
+        )
+        take_left = left_dist <= right_dist
+        best = np.where(take_left, left_dist, right_dist)
+        found = best != no_neighbor
+
+        dist[i] = np.where(found, best, -1)
+        idx[i] = np.where(
+            found, 
+            order[np.where(take_left, left, right).clip(0, n-1)], 
+            -1
+        )
+
+        # Step past the neighbor that was just used
+        left = np.where(found & take_left, left - 1, left)
+        right = np.where(found & ~take_left, right + 1, right)
+    return dist, idx
+
 def nearest(
         from_df: pl.DataFrame, 
         to_df: pl.DataFrame, 
@@ -50,38 +488,79 @@ def nearest(
         join_to_df: bool = True,
         join_to_df_cols: list[str] = None,
         to_df_col = r"{col}{i}",
-        temp_idx = "__nearest_index__"
+        engine: str = "auto",
+        to_index: Tuple[np.ndarray, np.ndarray] = None
     ):
-    assert temp_idx not in from_df.columns, (
-        f"temp_idx is '{temp_idx}', found in from_df.columns. "
-        "Must be new temporary col name."
-    )
-    assert temp_idx not in to_df.columns, (
-        f"temp_idx is '{temp_idx}', found in to_df.columns. "
-        "Must be new temporary col name."
-    )
+    """
+    Label rows of from_df with their k nearest rows in to_df.
+
+    engine:
+        "sorted": binary search over sorted positions. 1-D only, supports
+            query_kw={"k": k}, returns int64 distances.
+        "kdtree": scipy KDTree. Any dimension and KDTree.query kwargs,
+            returns float distances.
+        "auto": "sorted" for a single position column, else "kdtree".
+    to_index optionally gives (sorted_pos, order) of to_df's position
+    column for the "sorted" engine, e.g. from PositionIndex.sorted_positions.
+    Rows without a kth neighbor (e.g. to_df is empty) get null results.
+    Results are gathered from to_df by position, so from_df row order is kept.
+    """
     assert join_dist or join_to_df, (
         "At least one of 'join_dist' or 'join_to_df' must be True"
     )
-    
+    if engine == "auto":
+        only_k = set(query_kw or {}).issubset({"k"})
+        engine = "sorted" if len(from_cols) == 1 and only_k else "kdtree"
+    assert engine in ("sorted", "kdtree"), (
+        f"engine is '{engine}', must be one of 'auto', 'sorted', 'kdtree'"
+    )
 
-    # Detect distances to rows in 'to_pos'
-    to_pos = to_df.select(*to_cols).to_numpy()
-    tree = KDTree(to_pos)
+    if engine == "sorted":
+        assert len(from_cols) == 1 and len(to_cols) == 1, (
+            "engine 'sorted' requires a single from_col and to_col"
+        )
+        assert set(query_kw or {}).issubset({"k"}), (
+            "engine 'sorted' only supports query_kw 'k'"
+        )
+        # Binary search for neighbors on either side of each position
+        k = (query_kw or {}).get("k", 1)
+        if to_index is None:
+            sorted_pos, order = _sorted_index(to_df[to_cols[0]].to_numpy())
+        else:
+            sorted_pos, order = to_index
+            assert len(order) == to_df.height, (
+                "to_index does not match to_df, which must be unfiltered"
+            )
+        from_pos = from_df[from_cols[0]].to_numpy()
+        dist, idx = _query_sorted(sorted_pos, order, from_pos, k)
+        missing = idx < 0
+    elif to_df.height == 0:
+        # KDTree can't be built without points, so no row has a neighbor
+        k = (query_kw or {}).get("k", 1)
+        dist = np.full((k, from_df.height), np.nan)
+        idx = np.full((k, from_df.height), -1)
+        missing = idx < 0
+    else:
+        # Detect distances to rows in 'to_pos'
+        to_pos = to_df.select(*to_cols).to_numpy()
+        tree = KDTree(to_pos)
 
-    # Get distances and indices for every row in 'from_df' 
-    from_pos = from_df.select(*from_cols).to_numpy()
-    dist, idx = tree.query(from_pos, **(query_kw or {}))
+        # Get distances and indices for every row in 'from_df' 
+        from_pos = from_df.select(*from_cols).to_numpy()
+        dist, idx = tree.query(from_pos, **(query_kw or {}))
 
-    # Homogenize dist and idx to arrays of shape (k, row_count)
-    if len(dist.shape) == 2:
-        # If k=2+, dist and idx initially have shape (row_count,k)
-        dist = dist.T
-        idx = idx.T
-    else:
-        # If k=1, dist and idx initially have shape (row_count,)
-        dist = dist[None, :]
-        idx = idx[None, :]
+        # Homogenize dist and idx to arrays of shape (k, row_count)
+        if len(dist.shape) == 2:
+            # If k=2+, dist and idx initially have shape (row_count,k)
+            dist = dist.T
+            idx = idx.T
+        else:
+            # If k=1, dist and idx initially have shape (row_count,)
+            dist = dist[None, :]
+            idx = idx[None, :]
+
+        # KDTree flags missing neighbors with index len(to_df)
+        missing = idx >= to_df.height
 
     # Safety checks
     assert dist.shape[1] == from_df.shape[0]
@@ -89,48 +568,183 @@ def nearest(
 
     # Number of nearest neighbors queried
     k = dist.shape[0]   
-    
-    # Build result df
-    result_df = from_df.clone()
+
+    # Build result columns to stack alongside 'from_df', which is not copied
+    result_dfs = [from_df]
 
     if join_dist:
-        # Add distances to result_df
-        dist_dict = {dist_col.format(i=i+1): dist[i] for i in range(k)}
-        result_df = pl.concat(
-            [result_df, pl.DataFrame(dist_dict)], 
-            how="horizontal"
-        )
+        # Add distances as new columns
+        result_dfs.append(pl.DataFrame([
+            _null_where(dist[i], missing[i]).alias(dist_col.format(i=i+1))
+            for i in range(k)
+        ]))
 
     if join_to_df:
-        # 1. Temporarily add to_df indices to result_df 
-        idx_dict = {f"{temp_idx}{i+1}": idx[i] for i in range(k)}
-        result_df = pl.concat([result_df, pl.DataFrame(idx_dict)], how="horizontal")
-
-        # 2. Iteratively join with 'to_df' on nearest-neighbor i
-        to_df_idx = (
-            to_df
-            .select(*(join_to_df_cols or to_df.columns))
-            .with_row_index(temp_idx)
-        )
-        for i, idx_col in enumerate(idx_dict, start=1):
-            
-            # 2.1 Rename columns in 'to_df' for current nearest neighbor
-            to_df_idx_i = (
-                to_df_idx.rename({
-                    col: to_df_col.format(col=col, i=i)
-                    for col in to_df_idx.columns
-                    if col != temp_idx
-                })
+        # Gather the ith nearest 'to_df' row for each 'from_df' row by position
+        to_df_selected = to_df.select(*(join_to_df_cols or to_df.columns))
+        for i in range(k):
+            neighbor_idx = _null_where(idx[i], missing[i]).cast(pl.UInt32)
+            result_dfs.append(
+                to_df_selected[neighbor_idx]
+                .rename(lambda col: to_df_col.format(col=col, i=i+1))
             )
 
-            # 2.2 Join 'result_df' with renamed 'to_df' and drop idx col
-            result_df = (
-                result_df.join(
-                    to_df_idx_i, 
-                    left_on=idx_col, 
-                    right_on=temp_idx
-                )
-                .drop(idx_col)
-            )
+    return pl.concat(result_dfs, how="horizontal")
+
+def nearest_stranded(
+        from_df: pl.DataFrame, 
+        to_df: pl.DataFrame, 
+        from_col: str, 
+        to_col: str, 
+        strand_col: str = "strand",
+        directions: list[str] = ["any", "upstream", "downstream"],
+        join_to_df_cols: list[str] = None,
+        dist_col = r"sdist_{direction}",
+        to_df_col = r"{col}_{direction}"
+    ) -> pl.DataFrame:
+    """
+    Label rows of from_df with their nearest stranded to_df row, with signed distance.
+
+    Distances are (from_pos - to_pos), negated for "-" strand targets, so they
+    are negative when the from_df row is upstream of the target and positive
+    when downstream. Targets with strands other than "+"/"-" are ignored.
+
+    directions selects which neighbors to report, all from one search:
+        "any": nearest target
+        "upstream": nearest target the row is upstream of (distance <= 0)
+        "downstream": nearest target the row is downstream of (distance >= 0)
+    Rows without such a target get null results.
+    """
+    assert set(directions).issubset({"any", "upstream", "downstream"}), (
+        f"directions is {directions}, must be from 'any', 'upstream', 'downstream'"
+    )
+    from_pos = from_df[from_col].to_numpy().astype(np.int64)
+    to_pos = to_df[to_col].to_numpy().astype(np.int64)
+    to_strand = to_df[strand_col].to_numpy()
+
+    # 1. For each strand, the targets just left (<= from_pos) and right (>= from_pos)
+    no_neighbor = np.iinfo(np.int64).max
+    flank = {}
+    for strand in ("+", "-"):
+        strand_idx = np.flatnonzero(to_strand == strand)
+        sorted_pos, order = _sorted_index(to_pos[strand_idx])
+        n = len(sorted_pos)
+        left = np.searchsorted(sorted_pos, from_pos, side="right") - 1
+        right = np.searchsorted(sorted_pos, from_pos, side="left")
+
+        # A trailing sentinel keeps lookups at -1 and n in bounds. They are masked.
+        sorted_pos = np.append(sorted_pos, 0)
+        order = np.append(strand_idx[order], -1)
+        flank[strand, "left"] = (
+            np.where(left >= 0, from_pos - sorted_pos[left], no_neighbor),
+            np.where(left >= 0, order[left], -1)
+        )
+        flank[strand, "right"] = (
+            np.where(right < n, sorted_pos[right] - from_pos, no_neighbor),
+            np.where(right < n, order[right], -1)
+        )
+
+    # 2. Upstream of a "+" target means left of it, upstream of "-" means right
+    def closest(a, b, sign):
+        "Pick the closer of two (abs_dist, idx) candidates and sign the distance"
+        take_a = a[0] <= b[0]
+        abs_dist = np.where(take_a, a[0], b[0])
+        idx = np.where(take_a, a[1], b[1])
+        return sign * abs_dist, idx, abs_dist == no_neighbor
+    upstream = closest(flank["+", "right"], flank["-", "left"], -1)
+    downstream = closest(flank["+", "left"], flank["-", "right"], 1)
+    take_up = np.abs(upstream[0]) <= np.abs(downstream[0])
+    any_ = tuple(np.where(take_up, up, down) for up, down in zip(upstream, downstream))
+    neighbors = {"any": any_, "upstream": upstream, "downstream": downstream}
+
+    # 3. Add signed distances and gather neighbor columns by position
+    to_df_selected = to_df.select(*(join_to_df_cols or to_df.columns))
+    result_dfs = [from_df]
+    for direction in directions:
+        dist, idx, missing = neighbors[direction]
+        result_dfs.append(pl.DataFrame([
+            _null_where(dist, missing).alias(dist_col.format(direction=direction))
+        ]))
+        result_dfs.append(
+            to_df_selected[_null_where(idx, missing).cast(pl.UInt32)]
+            .rename(lambda col: to_df_col.format(col=col, direction=direction))
+        )
+    return pl.concat(result_dfs, how="horizontal")
+
+def nearest_many(
+        from_df: pl.DataFrame | pl.LazyFrame, 
+        to_dfs: Dict[str, pl.DataFrame | pl.LazyFrame], 
+        from_cols: list[str], 
+        to_cols: Dict[str, list[str]], 
+        partition_by: list[str] = ["chrom"],
+        join_to_df_cols: Dict[str, list[str]] = None,
+        dist_col = r"dist_{name}{i}",
+        to_df_col = r"{col}{i}",
+        executor: str = None,
+        n_workers: int = None,
+        indexes: Dict[str, PositionIndex] = None,
+        **nearest_kw
+    ) -> pl.DataFrame:
+    """
+    Label rows of from_df with their nearest rows in each of several named to_dfs.
+
+    from_df is partitioned once, and each partition is labeled with the
+    neighbors from every to_df in a single task. '{name}' in dist_col and
+    to_df_col is replaced with the to_dfs key. to_cols and join_to_df_cols
+    map to_dfs keys to the arguments of the same name in nearest, which also
+    receives nearest_kw. Rows on partitions absent from a to_df get nulls.
+    indexes optionally maps to_dfs keys to a PositionIndex of their to_cols.
+    """
+    join_to_df_cols = join_to_df_cols or {}
+    indexes = indexes or {}
+    from_p = _partitions(from_df, partition_by)
+    to_ps = {name: _partitions(to_df, partition_by) for name, to_df in to_dfs.items()}
+    to_missing = {name: to_df.clear() for name, to_df in to_dfs.items()}
+    nearest_kws = {
+        name: {
+            "from_cols": from_cols,
+            "to_cols": to_cols[name],
+            "join_to_df_cols": join_to_df_cols.get(name),
+            "dist_col": dist_col.replace("{name}", name),
+            "to_df_col": to_df_col.replace("{name}", name),
+            **nearest_kw
+        }
+        for name in to_dfs
+    }
+    tasks = [
+        (
+            from_p[key], 
+            {name: to_p.get(key, to_missing[name]) for name, to_p in to_ps.items()}, 
+            nearest_kws,
+            {name: index.sorted_positions(key) for name, index in indexes.items()}
+        )
+        for key in sorted(from_p)
+    ]
+    results = _map_partitions(_nearest_many_partition, tasks, executor, n_workers)
+    return pl.concat(results)
+
+def _nearest_many_partition(
+        from_df: pl.DataFrame | pl.LazyFrame, 
+        to_dfs: Dict[str, pl.DataFrame | pl.LazyFrame], 
+        nearest_kws: Dict[str, Dict[str, Any]],
+        to_indexes: Dict[str, Tuple[np.ndarray, np.ndarray]]
+    ) -> pl.DataFrame:
+    "nearest_many on a single partition"
+    result_df = from_df.collect() if isinstance(from_df, pl.LazyFrame) else from_df
+    for name, to_df in to_dfs.items():
+        if isinstance(to_df, pl.LazyFrame):
+            to_df = to_df.collect()
+        result_df = nearest(
+            result_df, 
+            to_df, 
+            to_index=to_indexes.get(name), 
+            **nearest_kws[name]
+        )
+    return result_df
 
-    return result_df
\ No newline at end of file
+def _null_where(values: np.ndarray, mask: np.ndarray) -> pl.Series:
+    "Convert values to a Series with nulls where mask is True"
+    series = pl.Series(values)
+    if mask.any():
+        series = series.scatter(np.flatnonzero(mask), None)
+    return series
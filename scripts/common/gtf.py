@@ -0,0 +1,154 @@
+import gzip
+import shutil
+import subprocess
+from pathlib import Path
+import polars as pl
+from common.cache import content_hash
+
+GTF_COLUMNS = ["chrom", "source", "feature", "start", "end", "score", "strand", "frame", "attribute"]
+GTF_SCHEMA = {
+    "chrom": pl.String,
+    "source": pl.String,
+    "feature": pl.String,
+    "start": pl.Int32,
+    "end": pl.Int32,
+    "score": pl.String,
+    "strand": pl.String,
+    "frame": pl.String,
+    "attribute": pl.String,
+}
+
+# Attributes decoded from each line, all as strings
+GENCODE_ATTRIBUTES = [
+    "gene_id",
+    "gene_name",
+    "gene_type",
+    "transcript_id",
+    "transcript_name",
+    "transcript_type",
+    "transcript_support_level",
+    "exon_number",
+]
+
+def read_gtf_bytes(path: str | Path) -> bytes:
+    """
+    Decompressed GTF contents.
+
+    pigz, if it is installed, is faster than Python's gzip, as it reads,
+    checks and writes on separate threads. Inflating a gzip stream is serial
+    either way.
+    """
+    path = str(path)
+    if not path.endswith(".gz"):
+        with open(path, "rb") as f:
+            return f.read()
+    if shutil.which("pigz"):
+        return subprocess.run(["pigz", "-dc", path], capture_output=True, check=True).stdout
+    with gzip.open(path, "rb") as f:
+        return f.read()
+
+# One 'key "value"' or 'key value' attribute; quoted values may hold ';' and escaped quotes
+ATTRIBUTE_PAIR = r'\w+\s+(?:"[^"\\]*(?:\\.[^"\\]*)*"|[^";\s]+)'
+
+def parse_attributes(attribute: pl.Series, keys: list[str]) -> pl.DataFrame:
+    """
+    String values of keys in a GTF attribute column, one column per key.
+
+    Each line is tokenized once into its key/value pairs, which are split
+    and looked up by key. Quoted values may contain ';' and escaped quotes,
+    and unquoted values (e.g. exon_number 3) are accepted. Repeated keys
+    (e.g. tag) keep their first value; missing keys are null.
+    """
+    sep = pl.col.pair.str.find(" ", literal=True)
+    value = pl.col.value.str.strip_chars_start()
+    pairs = (
+        attribute.str.extract_all(ATTRIBUTE_PAIR).alias("pair").to_frame()
+        .lazy()
+        .with_row_index("line")
+        .explode("pair", empty_as_null=False)
+        .select("line", key=pl.col.pair.str.slice(0, sep), value=pl.col.pair.str.slice(sep))
+        .filter(pl.col.key.is_in(keys))
+        .with_columns(
+            value=pl.when(value.str.starts_with('"'))
+            .then(value.str.slice(1, value.str.len_chars() - 2).str.replace_all(r"\\(.)", "$1"))
+            .otherwise(value)
+        )
+        .group_by("line", maintain_order=True)
+        .agg(pl.col.value.filter(pl.col.key == key).first().alias(key) for key in keys)
+        .collect()
+    )
+    # Lines without any of the keys have no pairs left
+    lines = pl.DataFrame({"line": pl.int_range(len(attribute), dtype=pl.UInt32, eager=True)})
+    return lines.join(pairs, on="line", how="left", maintain_order="left").drop("line")
+
+def _versioned(col: str) -> tuple[pl.Expr, pl.Expr]:
+    "(ID without version, ID with version); empty when unversioned, as regexp_extract gives"
+    value = pl.col(col)
+    return (
+        value.str.extract(r"^(.*?)\.[0-9]+$", 1).fill_null(""),
+        value.str.extract(r"^(.*?\.[0-9]+)$", 1).fill_null(""),
+    )
+
+def parse_gtf(path: str | Path) -> pl.DataFrame:
+    "All GTF lines with GENCODE attributes split into columns"
+    gtf = pl.read_csv(
+        read_gtf_bytes(path),
+        separator="\t",
+        has_header=False,
+        comment_prefix="#",
+        quote_char=None,
+        new_columns=GTF_COLUMNS,
+        schema_overrides=GTF_SCHEMA,
+    )
+    gene_id, gene_id_full = _versioned("gene_id")
+    transcript_id, transcript_id_full = _versioned("transcript_id")
+    return (
+        gtf
+        .select("chrom", "start", "end", "strand", "feature")
+        .hstack(parse_attributes(gtf["attribute"], GENCODE_ATTRIBUTES))
+        .select(
+            "chrom",
+            "start",
+            "end",
+            "strand",
+            "feature",
+            pl.col.gene_name.fill_null(""),
+            gene_id.alias("gene_id"),
+            gene_id_full.alias("gene_id_full"),
+            transcript_id.alias("transcript_id"),
+            transcript_id_full.alias("transcript_id_full"),
+            pl.col.transcript_name.fill_null(""),
+            pl.col.gene_type.fill_null(""),
+            pl.col.transcript_type.fill_null(""),
+            pl.col.transcript_support_level.cast(pl.Int32, strict=False),
+            pl.col.exon_number.cast(pl.Int32, strict=False),
+        )
+    )
+
+def load_gtf(path: str | Path, cache_dir: str | Path = "output/cache/gtf") -> dict[str, pl.LazyFrame]:
+    """
+    Scans of the parsed GTF, one per feature type (gene, transcript, exon, ...).
+
+    The GTF is parsed once and each feature is written to
+    '{cache_dir}/{name}-{content hash}/{feature}.parquet'. Later loads of a
+    file with the same contents only scan the cached tables.
+    """
+    path = Path(path)
+    cache_dir = Path(cache_dir)
+    root = cache_dir / f"{path.name}-{content_hash(path)[:16]}"
+    if not root.exists():
+        # Tables parsed from older versions of the same file are replaced
+        for stale in cache_dir.glob(f"{path.name}-*"):
+            shutil.rmtree(stale)
+        tmp_root = root.with_name(root.name + ".tmp")
+        shutil.rmtree(tmp_root, ignore_errors=True)
+        tmp_root.mkdir(parents=True)
+        for (feature,), df in parse_gtf(path).partition_by("feature", as_dict=True).items():
+            df.write_parquet(tmp_root / f"{feature}.parquet")
+
+        # Move into place only once complete so readers never see partial tables
+        tmp_root.rename(root)
+    return {
+        file.stem: pl.scan_parquet(file)
+        for file in sorted(root.glob("*.parquet"))
+    }
@@ -0,0 +1,394 @@
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import polars as pl
+
+def snap_windows_multires(loops: pl.DataFrame, flank_bins: dict[int, int], chromsizes: dict[str, int]) -> pl.DataFrame:
+    """
+    Bins of each anchor center at several resolutions, and whether every window is on its chromosome.
+
+    flank_bins maps each resolution to its flank in bins. Anchor centers and
+    chromosome sizes are looked up once; at each resolution r the centers
+    are snapped to the nearest bin boundary as 'bin1_{r}' and 'bin2_{r}',
+    and in_bounds requires the windows at all resolutions to fit.
+    """
+    sizes = pl.DataFrame({"chrom": list(chromsizes), "size": list(chromsizes.values())})
+    windows = loops.with_columns(
+        **{f"_center{i}": (pl.col(f"start{i}") + pl.col(f"end{i}")) // 2 for i in [1, 2]}
+    )
+    for i in [1, 2]:
+        windows = windows.join(
+            sizes.rename({"chrom": f"chrom{i}", "size": f"_size{i}"}),
+            on=f"chrom{i}",
+            how="left",
+            maintain_order="left"
+        )
+    bins = {}
+    in_bounds = pl.lit(True)
+    for resolution, flank in flank_bins.items():
+        for i in [1, 2]:
+            center_bin = (pl.col(f"_center{i}") / resolution).round().cast(pl.Int64)
+            bins[f"bin{i}_{resolution}"] = center_bin
+            in_bounds = (
+                in_bounds
+                & ((center_bin - flank) * resolution >= 0)
+                & ((center_bin + flank) * resolution < pl.col(f"_size{i}"))
+            )
+    return (
+        windows
+        .with_columns(**bins, in_bounds=in_bounds.fill_null(False))
+        .drop("_center1", "_center2", "_size1", "_size2")
+    )
+
+def snap_windows(loops: pl.DataFrame, resolution: int, flank_bins: int, chromsizes: dict[str, int]) -> pl.DataFrame:
+    """
+    Bin of each anchor center, and whether both flanked windows are on their chromosome.
+
+    Centers are snapped to the nearest bin boundary; a window spans
+    flank_bins bins either side of it, inclusive.
+    """
+    return (
+        snap_windows_multires(loops, {resolution: flank_bins}, chromsizes)
+        .rename({f"bin1_{resolution}": "bin1", f"bin2_{resolution}": "bin2"})
+    )
+
+def _chunks(
+        bin1: np.ndarray,
+        bin2: np.ndarray,
+        flank_bins: int,
+        max_box_bins: int,
+        min_fill: float,
+        intra: bool
+    ):
+    """
+    Split loops (sorted by bin1) into runs whose windows share one fetch box.
+
+    A loop joins the current run while the box bounding all windows stays
+    within max_box_bins per side, its windows fill at least min_fill of it,
+    and (for intra-chromosomal boxes) the row range stays entirely before
+    the column range, as each loop's own window does.
+    """
+    w = 2 * flank_bins + 1
+    start = 0
+    col_min = col_max = bin2[0] if len(bin2) else 0
+    for i in range(1, len(bin1)):
+        new_min, new_max = min(col_min, bin2[i]), max(col_max, bin2[i])
+        rows = bin1[i] - bin1[start] + w
+        cols = new_max - new_min + w
+        fits = (
+            max(rows, cols) <= max_box_bins
+            and (i + 1 - start) * w * w >= min_fill * rows * cols
+            and (not intra or bin1[i] + flank_bins < new_min - flank_bins)
+        )
+        if fits:
+            col_min, col_max = new_min, new_max
+        else:
+            yield start, i
+            start, col_min, col_max = i, bin2[i], bin2[i]
+    if len(bin1):
+        yield start, len(bin1)
+
+def _fill_snippets(
+        windows: pl.DataFrame,
+        hic,
+        flank_bins: int,
+        normalization: str,
+        out: np.ndarray,
+        max_box_bins: int,
+        min_fill: float
+    ):
+    "Fetch windows (with chrom1, chrom2, bin1, bin2 and output row '_out') into out"
+    resolution = hic.resolution()
+    w = 2 * flank_bins + 1
+    for (chrom1, chrom2), part in windows.partition_by("chrom1", "chrom2", as_dict=True).items():
+        part = part.sort("bin1", "bin2")
+        bin1, bin2 = part["bin1"].to_numpy(), part["bin2"].to_numpy()
+        out_rows = part["_out"].to_numpy()
+        chunks = _chunks(bin1, bin2, flank_bins, max_box_bins, min_fill, intra=chrom1 == chrom2)
+        for start, end in chunks:
+            r0, r1 = bin1[start:end].min() - flank_bins, bin1[start:end].max() + flank_bins
+            c0, c1 = bin2[start:end].min() - flank_bins, bin2[start:end].max() + flank_bins
+            box = hic.fetch(
+                f"{chrom1}:{r0 * resolution}-{r1 * resolution}",
+                f"{chrom2}:{c0 * resolution}-{c1 * resolution}",
+                normalization
+            ).to_numpy()
+            assert box.shape == (r1 - r0 + 1, c1 - c0 + 1), (
+                f"Fetched box of shape {box.shape}, expected {(r1 - r0 + 1, c1 - c0 + 1)}"
+            )
+            for j in range(start, end):
+                r, c = bin1[j] - flank_bins - r0, bin2[j] - flank_bins - c0
+                out[out_rows[j]] = box[r:r + w, c:c + w]
+
+def _fill_snippets_per_loop(windows: pl.DataFrame, hic, flank_bins: int, normalization: str, out: np.ndarray):
+    "Fetch each window (with chrom1, chrom2, bin1, bin2 and output row '_out') into out on its own"
+    resolution = hic.resolution()
+    for loop in windows.iter_rows(named=True):
+        r0, r1 = loop["bin1"] - flank_bins, loop["bin1"] + flank_bins
+        c0, c1 = loop["bin2"] - flank_bins, loop["bin2"] + flank_bins
+        out[loop["_out"]] = hic.fetch(
+            f"{loop['chrom1']}:{r0 * resolution}-{r1 * resolution}",
+            f"{loop['chrom2']}:{c0 * resolution}-{c1 * resolution}",
+            normalization
+        ).to_numpy()
+
+def _kept_windows(loops: pl.DataFrame, resolution: int, flank_bins: int, chromsizes: dict[str, int]) -> pl.DataFrame:
+    "In-bounds windows with their input row '_row' and output row '_out'"
+    return (
+        snap_windows(loops, resolution, flank_bins, chromsizes)
+        .with_row_index("_row")
+        .filter(pl.col.in_bounds)
+        .with_row_index("_out")
+    )
+
+def extract_snippets(
+        loops: pl.DataFrame,
+        hic,
+        flank_bins: int,
+        normalization: str,
+        max_box_bins: int = 512,
+        min_fill: float = 0.05,
+        batched: bool = True
+    ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (2f+1)x(2f+1) contact windows around each loop, fetched in batches.
+
+    Loops are grouped by chromosome pair and sorted by position, and nearby
+    loops share one dense fetch of the box bounding their windows, so each
+    region of the .hic file is decoded once per box rather than once per
+    loop. Windows are copied from the boxes into one preallocated float32
+    (n, 2f+1, 2f+1) array. With batched=False each window is fetched on
+    its own instead, as a reference for the batched path.
+
+    Returns (snippets, loop_index): loop_index holds the row of loops each
+    snippet came from, in input order. Loops whose windows leave the
+    chromosome are skipped.
+    """
+    w = 2 * flank_bins + 1
+    windows = _kept_windows(loops, hic.resolution(), flank_bins, hic.chromosomes())
+    snippets = np.empty((len(windows), w, w), dtype=np.float32)
+    if batched:
+        _fill_snippets(windows, hic, flank_bins, normalization, snippets, max_box_bins, min_fill)
+    else:
+        _fill_snippets_per_loop(windows, hic, flank_bins, normalization, snippets)
+    return snippets, windows["_row"].to_numpy().astype(np.int64)
+
+def extract_snippets_multires(
+        loops: pl.DataFrame,
+        hics: dict[int, object],
+        flank_bp: int,
+        normalization: str,
+        max_box_bins: int = 512,
+        min_fill: float = 0.05
+    ) -> tuple[dict[int, np.ndarray], np.ndarray]:
+    """
+    extract_snippets at several resolutions in one pass.
+
+    hics maps each resolution to a file opened at that resolution, used
+    for all loops. Windows span flank_bp either side of the loop center,
+    i.e. flank_bp // resolution bins. Centers and bounds are computed once,
+    and a loop is kept only if its windows fit at every resolution, so all
+    resolutions share one loop_index.
+
+    Returns ({resolution: snippets}, loop_index).
+    """
+    for resolution in hics:
+        assert flank_bp % resolution == 0, f"flank_bp {flank_bp} is not a multiple of resolution {resolution}"
+    flank_bins = {resolution: flank_bp // resolution for resolution in hics}
+    chromsizes = next(iter(hics.values())).chromosomes()
+    windows = (
+        snap_windows_multires(loops, flank_bins, chromsizes)
+        .with_row_index("_row")
+        .filter(pl.col.in_bounds)
+        .with_row_index("_out")
+    )
+    snippets = {}
+    for resolution, hic in hics.items():
+        w = 2 * flank_bins[resolution] + 1
+        snippets[resolution] = np.empty((len(windows), w, w), dtype=np.float32)
+        _fill_snippets(
+            windows.rename({f"bin1_{resolution}": "bin1", f"bin2_{resolution}": "bin2"}),
+            hic,
+            flank_bins[resolution],
+            normalization,
+            snippets[resolution],
+            max_box_bins,
+            min_fill
+        )
+    return snippets, windows["_row"].to_numpy().astype(np.int64)
+
+# Per-worker .hic handle, opened once by _open_hic
+_worker_hic = None
+
+def _open_hic(hic_path: str, resolution: int, matrix_type: str):
+    "Worker initializer: open the worker's own handle on the .hic file"
+    global _worker_hic
+    import hictkpy
+    _worker_hic = hictkpy.File(hic_path, resolution=resolution, matrix_type=matrix_type)
+
+def _extract_shard(
+        windows: pl.DataFrame,
+        shm_name: str,
+        shape: tuple[int, int, int],
+        flank_bins: int,
+        normalization: str,
+        max_box_bins: int,
+        min_fill: float
+    ) -> int:
+    "Worker task: fill one shard's rows of the shared snippet array"
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        _fill_snippets(windows, _worker_hic, flank_bins, normalization, out, max_box_bins, min_fill)
+        del out
+    finally:
+        shm.close()
+    return len(windows)
+
+def extract_snippets_parallel(
+        loops: pl.DataFrame,
+        hic_path: str,
+        resolution: int,
+        matrix_type: str,
+        flank_bins: int,
+        normalization: str,
+        shard_by: list[str] = [],
+        n_workers: int = None,
+        max_box_bins: int = 512,
+        min_fill: float = 0.05,
+        progress: bool = True
+    ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    extract_snippets on a process pool.
+
+    Work is sharded by shard_by columns (e.g. loop categories) and
+    chromosome. Each worker opens its own handle on the .hic file and
+    writes its windows directly into one shared-memory array, so snippets
+    are not pickled back to the parent. With progress, the number of
+    loops extracted across all workers is printed as shards complete.
+
+    Call it from a script's __main__ block, since spawned workers
+    re-import the main script.
+
+    Returns (snippets, loop_index) as extract_snippets does.
+    """
+    import hictkpy
+    hic = hictkpy.File(hic_path, resolution=resolution, matrix_type=matrix_type)
+    chromsizes = hic.chromosomes()
+    del hic
+
+    w = 2 * flank_bins + 1
+    windows = _kept_windows(loops, resolution, flank_bins, chromsizes)
+    shape = (len(windows), w, w)
+    shards = windows.partition_by(*shard_by, "chrom1", maintain_order=False)
+
+    # SharedMemory rejects size 0
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(np.float32).itemsize))
+    try:
+        # Forking a process that has started polars' thread pool can deadlock
+        pool = ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_open_hic,
+            initargs=(hic_path, resolution, matrix_type)
+        )
+        with pool:
+            futures = [
+                pool.submit(_extract_shard, shard, shm.name, shape, flank_bins, normalization, max_box_bins, min_fill)
+                for shard in shards
+            ]
+            loaded = 0
+            for future in as_completed(futures):
+                loaded += future.result()
+                if progress:
+                    print(f"Loops loaded: {loaded}/{len(windows)}")
+        snippets = np.ndarray(shape, dtype=np.float32, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return snippets, windows["_row"].to_numpy().astype(np.int64)
+
+class PileupAggregator:
+    """
+    Per-pixel running statistics of snippets, in memory independent of their number.
+
+    Sums, counts of non-NaN values and NaN counts are exact. Quantiles are
+    approximated from a per-pixel histogram of n_bins log-spaced bins
+    between lo and hi. Values below lo (including zeros) and above hi fall
+    in two end bins spanning to the pixel's observed min and max, so
+    quantiles inside [lo, hi] are within one bin, a factor of
+    (hi/lo)**(1/n_bins), of the exact value.
+    """
+    def __init__(self, shape: tuple[int, int], lo: float = 1e-3, hi: float = 1e3, n_bins: int = 512):
+        self.shape = tuple(shape)
+        self.edges = np.geomspace(lo, hi, n_bins + 1)
+        self.sum = np.zeros(self.shape, dtype=np.float64)
+        self.count = np.zeros(self.shape, dtype=np.int64)
+        self.nan_count = np.zeros(self.shape, dtype=np.int64)
+        self.min = np.full(self.shape, np.inf)
+        self.max = np.full(self.shape, -np.inf)
+        # Bin 0 holds values below lo and bin n_bins + 1 values from hi up
+        self.hist = np.zeros((np.prod(self.shape), n_bins + 2), dtype=np.int64)
+
+    def add(self, snippets: np.ndarray):
+        "Update with a (n, *shape) array of snippets, or a single snippet"
+        snippets = np.asarray(snippets, dtype=np.float64).reshape(-1, *self.shape)
+        if len(snippets) == 0:
+            return
+        is_nan = np.isnan(snippets)
+        self.nan_count += is_nan.sum(axis=0)
+        self.count += (~is_nan).sum(axis=0)
+        self.sum += np.where(is_nan, 0, snippets).sum(axis=0)
+        # fmin/fmax ignore NaN unless both operands are NaN
+        self.min = np.fmin(self.min, np.fmin.reduce(snippets, axis=0))
+        self.max = np.fmax(self.max, np.fmax.reduce(snippets, axis=0))
+
+        values = snippets.reshape(len(snippets), -1)
+        bins = np.searchsorted(self.edges, values, side="right")
+        pixels = np.broadcast_to(np.arange(values.shape[1]), values.shape)
+        keep = ~is_nan.reshape(values.shape)
+        flat = pixels[keep] * self.hist.shape[1] + bins[keep]
+        self.hist += np.bincount(flat, minlength=self.hist.size).reshape(self.hist.shape)
+
+    def mean(self) -> np.ndarray:
+        "Per-pixel mean of non-NaN values, as np.nanmean"
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 0, self.sum / self.count, np.nan)
+
+    def quantile(self, q: float) -> np.ndarray:
+        "Approximate per-pixel q-quantile of non-NaN values (NaN where there are none)"
+        count = self.count.reshape(-1)
+        # Fractional 0-based rank, as numpy's default 'linear' method
+        rank = q * np.maximum(count - 1, 0)
+        cum = np.cumsum(self.hist, axis=1)
+        b = np.minimum((cum <= rank[:, None]).sum(axis=1), self.hist.shape[1] - 1)
+        pixels = np.arange(len(count))
+        before = cum[pixels, b] - self.hist[pixels, b]
+
+        # Bin bounds, with the end bins reaching the observed min and max
+        vmin, vmax = self.min.reshape(-1), self.max.reshape(-1)
+        bounds = np.concatenate([
+            np.minimum(vmin, self.edges[0])[:, None],
+            np.broadcast_to(self.edges, (len(count), len(self.edges))),
+            np.maximum(vmax, self.edges[-1])[:, None],
+        ], axis=1)
+        lower, upper = bounds[pixels, b], bounds[pixels, b + 1]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            frac = (rank - before + 0.5) / self.hist[pixels, b]
+            value = lower + np.clip(frac, 0, 1) * (upper - lower)
+        value = np.clip(value, vmin, vmax)
+        return np.where(count > 0, value, np.nan).reshape(self.shape)
+
+    def median(self) -> np.ndarray:
+        "Approximate per-pixel median of non-NaN values"
+        return self.quantile(0.5)
+
+    def aggregate(self, method: str) -> np.ndarray:
+        "Pileup by method: 'mean', 'sum', 'median', 'count' or 'nan_count'"
+        assert method in ("mean", "sum", "median", "count", "nan_count"), (
+            f"method is '{method}', must be one of 'mean', 'sum', 'median', 'count', 'nan_count'"
+        )
+        if method in ("mean", "median"):
+            return getattr(self, method)()
+        return getattr(self, method)
@@ -0,0 +1,194 @@
+import numpy as np
+
+# Resampled arrays are built in chunks of about this many bytes
+CHUNK_BYTES = 1 << 28
+
+def _flat(snippets: np.ndarray) -> np.ndarray:
+    "(n, w, w) snippets as an (n, w * w) float32 array"
+    snippets = np.asarray(snippets, dtype=np.float32)
+    return snippets.reshape(len(snippets), -1)
+
+def _chunk_sizes(total: int, per_item_bytes: int, chunk_bytes: int = CHUNK_BYTES):
+    "Split total items into chunks of at most chunk_bytes"
+    size = max(1, chunk_bytes // max(per_item_bytes, 1))
+    for start in range(0, total, size):
+        yield min(size, total - start)
+
+def _weighted_means(weights: np.ndarray, values: np.ndarray, present: np.ndarray) -> np.ndarray:
+    "NaN-aware means of values rows for each row of weights"
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (weights @ values) / (weights @ present)
+
+def _weighted_medians(weights: np.ndarray, values: np.ndarray, block: int = 64) -> np.ndarray:
+    """
+    NaN-aware medians of values columns for each row of weights, counting
+    values row i weights[:, i] times.
+
+    Each pixel is sorted once. Weights are summed over blocks of the
+    sorted order to find the block holding each median rank, and only
+    that block is scanned element by element.
+    """
+    n_rows = len(weights)
+    rows = np.arange(n_rows)
+    # Transposed so that gathering in sorted order copies whole rows
+    weights_t = np.ascontiguousarray(weights.T)
+    medians = np.full((n_rows, values.shape[1]), np.nan)
+    for pixel in range(values.shape[1]):
+        column = values[:, pixel]
+        order = np.argsort(column)
+        order = order[~np.isnan(column[order])]
+        m = len(order)
+        if m == 0:
+            continue
+        sorted_values = column[order]
+        sorted_weights = weights_t[order]
+        cum_blocks = np.cumsum(np.add.reduceat(sorted_weights, np.arange(0, m, block), axis=0), axis=0)
+        total = cum_blocks[-1]
+        median = np.zeros(n_rows)
+        # Average of the values at 0-based ranks (total - 1) // 2 and total // 2
+        for rank in ((total - 1) // 2, total // 2):
+            b = np.minimum((cum_blocks <= rank).sum(axis=0), len(cum_blocks) - 1)
+            before = np.where(b > 0, cum_blocks[b - 1, rows], 0)
+            positions = b * block + np.arange(block)[:, None]
+            in_range = positions < m
+            cum = before + np.cumsum(
+                np.where(in_range, sorted_weights[np.minimum(positions, m - 1), rows], 0), axis=0
+            )
+            position = b * block + (cum <= rank).sum(axis=0)
+            median += sorted_values[np.minimum(position, m - 1)]
+        medians[:, pixel] = np.where(total > 0, median / 2, np.nan)
+    return medians
+
+def center_enrichment(pileups: np.ndarray, center_bins: int = 1, corner_bins: int = 3) -> np.ndarray:
+    """
+    Mean of the central center_bins square over the mean of the four
+    corner_bins corner squares, for (..., w, w) pileups.
+    """
+    w = pileups.shape[-1]
+    lo = (w - center_bins) // 2
+    center = np.nanmean(pileups[..., lo:lo + center_bins, lo:lo + center_bins], axis=(-2, -1))
+    k = corner_bins
+    corners = np.concatenate([
+        pileups[..., :k, :k], pileups[..., :k, -k:], pileups[..., -k:, :k], pileups[..., -k:, -k:]
+    ], axis=-1)
+    return center / np.nanmean(corners, axis=(-2, -1))
+
+def bootstrap_pileups(
+        snippets: np.ndarray,
+        n_boot: int = 1000,
+        statistic: str = "mean",
+        seed: int = None
+    ) -> np.ndarray:
+    """
+    (n_boot, w, w) pileups of snippets resampled with replacement.
+
+    Each chunk of resamples is a matrix of multinomial resampling counts,
+    multiplied into the snippet matrix for the mean and accumulated over
+    each pixel's sorted values for the median.
+    """
+    assert statistic in ("mean", "median"), f"statistic is '{statistic}', must be 'mean' or 'median'"
+    rng = np.random.default_rng(seed)
+    values = _flat(snippets)
+    n, n_pixels = values.shape
+    boot = np.empty((n_boot, n_pixels), dtype=np.float64)
+    present = (~np.isnan(values)).astype(np.float32)
+    filled = np.nan_to_num(values, nan=0)
+    done = 0
+    for size in _chunk_sizes(n_boot, n * 16):
+        weights = rng.multinomial(n, np.full(n, 1 / n), size=size).astype(np.int32)
+        if statistic == "mean":
+            boot[done:done + size] = _weighted_means(weights.astype(np.float32), filled, present)
+        else:
+            boot[done:done + size] = _weighted_medians(weights, values)
+        done += size
+    return boot.reshape(n_boot, *snippets.shape[1:])
+
+def bootstrap_ci(
+        snippets: np.ndarray,
+        n_boot: int = 1000,
+        statistic: str = "mean",
+        alpha: float = 0.05,
+        center_bins: int = 1,
+        corner_bins: int = 3,
+        seed: int = None
+    ) -> dict:
+    """
+    Per-pixel percentile confidence intervals and center enrichment of a pileup.
+
+    Returns a dict with the pileup, the per-pixel 'lower' and 'upper'
+    bounds, the 'enrichment' of the pileup, its 'enrichment_ci', and the
+    one-sided bootstrap 'p_value' that enrichment is not above 1.
+    """
+    values = np.asarray(snippets, dtype=np.float32)
+    pileup = np.nanmean(values, axis=0) if statistic == "mean" else np.nanmedian(values, axis=0)
+    boot = bootstrap_pileups(values, n_boot, statistic, seed)
+    lower, upper = np.nanquantile(boot, [alpha / 2, 1 - alpha / 2], axis=0)
+    boot_enrichment = center_enrichment(boot, center_bins, corner_bins)
+    return {
+        "pileup": pileup,
+        "lower": lower,
+        "upper": upper,
+        "enrichment": center_enrichment(pileup, center_bins, corner_bins),
+        "enrichment_ci": tuple(np.nanquantile(boot_enrichment, [alpha / 2, 1 - alpha / 2])),
+        "p_value": (1 + np.sum(boot_enrichment <= 1)) / (1 + n_boot),
+    }
+
+def permutation_test(
+        snippets1: np.ndarray,
+        snippets2: np.ndarray,
+        n_perm: int = 1000,
+        statistic: str = "mean",
+        center_bins: int = 1,
+        corner_bins: int = 3,
+        seed: int = None
+    ) -> dict:
+    """
+    Difference between two categories' pileups under label permutation.
+
+    Category labels are shuffled across the pooled snippets n_perm times.
+    Returns the observed per-pixel 'difference' (1 - 2) and its two-sided
+    per-pixel 'pixel_p_value', the observed 'enrichment_difference' and
+    its two-sided 'p_value'.
+    """
+    assert statistic in ("mean", "median"), f"statistic is '{statistic}', must be 'mean' or 'median'"
+    rng = np.random.default_rng(seed)
+    shape = np.shape(snippets1)[1:]
+    values = np.concatenate([_flat(snippets1), _flat(snippets2)])
+    n1, (n, n_pixels) = len(snippets1), values.shape
+
+    def pileups(in1: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        "Pileups of both groups for each row of a boolean group-1 membership matrix"
+        if statistic == "mean":
+            return (
+                _weighted_means(in1.astype(np.float32), filled, present),
+                _weighted_means((~in1).astype(np.float32), filled, present)
+            )
+        return _weighted_medians(in1.astype(np.int32), values), _weighted_medians((~in1).astype(np.int32), values)
+
+    present = (~np.isnan(values)).astype(np.float32)
+    filled = np.nan_to_num(values, nan=0)
+    observed = np.arange(n)[None, :] < n1
+    obs1, obs2 = pileups(observed)
+    difference = (obs1 - obs2).reshape(shape)
+    enrichment_difference = (
+        center_enrichment(obs1.reshape(shape), center_bins, corner_bins)
+        - center_enrichment(obs2.reshape(shape), center_bins, corner_bins)
+    )
+
+    pixel_exceed = np.zeros(n_pixels, dtype=np.int64)
+    enrichment_exceed = 0
+    for size in _chunk_sizes(n_perm, n * 16):
+        in1 = rng.random((size, n)).argsort(axis=1) < n1
+        perm1, perm2 = pileups(in1)
+        pixel_exceed += np.sum(np.abs(perm1 - perm2) >= np.abs(difference.reshape(-1)), axis=0)
+        perm_enrichment = (
+            center_enrichment(perm1.reshape(size, *shape), center_bins, corner_bins)
+            - center_enrichment(perm2.reshape(size, *shape), center_bins, corner_bins)
+        )
+        enrichment_exceed += np.sum(np.abs(perm_enrichment) >= abs(enrichment_difference))
+    return {
+        "difference": difference,
+        "pixel_p_value": ((1 + pixel_exceed) / (1 + n_perm)).reshape(shape),
+        "enrichment_difference": enrichment_difference,
+        "p_value": (1 + enrichment_exceed) / (1 + n_perm),
+    }
@@ -0,0 +1,92 @@
+import json
+import shutil
+from pathlib import Path
+from typing import Dict, Tuple
+import numpy as np
+import polars as pl
+from common.cache import content_hash
+
+class PositionIndex:
+    """
+    Per-partition sorted positions of a parquet file, stored as .npy files.
+
+    For each partition (e.g. chromosome) the index holds:
+        start: positions sorted ascending
+        end: interval ends in the same order (only for [start, end] indexes)
+        order: row number within the partition of each sorted position
+    Row numbers refer to the partition as produced by
+    pl.read_parquet(path).partition_by(partition_by), so frames queried with
+    the index must hold that partition's rows unfiltered and in file order.
+
+    Indexes live in '{path}.index/{cols}-{content hash}' and are memory-mapped
+    on load. A source file with new contents gets a new index.
+    """
+    def __init__(self, root: Path, partitions: Dict[tuple, Dict[str, np.ndarray]]):
+        self.root = root
+        self.partitions = partitions
+
+    @classmethod
+    def load(
+            cls, 
+            path: str | Path, 
+            pos_cols: list[str], 
+            partition_by: list[str] = ["chrom"]
+        ) -> "PositionIndex":
+        "Load the index of pos_cols for path, building it if it is missing or stale"
+        path = Path(path)
+        index_dir = path.parent / f"{path.name}.index"
+        cols_name = "_".join(partition_by) + "." + "_".join(pos_cols)
+        root = index_dir / f"{cols_name}-{content_hash(path)[:16]}"
+        if not (root / "manifest.json").exists():
+            # Stale indexes of the same columns are replaced
+            for stale in index_dir.glob(f"{cols_name}-*"):
+                shutil.rmtree(stale)
+            cls._build(path, pos_cols, partition_by, root)
+        return cls._open(root)
+
+    @staticmethod
+    def _build(path: Path, pos_cols: list[str], partition_by: list[str], root: Path):
+        "Sort positions of each partition and write them with a manifest"
+        df = pl.read_parquet(path, columns=partition_by + pos_cols)
+        tmp_root = root.with_name(root.name + ".tmp")
+        shutil.rmtree(tmp_root, ignore_errors=True)
+        tmp_root.mkdir(parents=True)
+        manifest = []
+        for i, (key, part) in enumerate(sorted(df.partition_by(partition_by, as_dict=True).items())):
+            start = part[pos_cols[0]].to_numpy().astype(np.int64)
+            order = np.argsort(start, kind="stable")
+            arrays = {"start": start[order], "order": order}
+            if len(pos_cols) == 2:
+                arrays["end"] = part[pos_cols[1]].to_numpy().astype(np.int64)[order]
+            for name, array in arrays.items():
+                np.save(tmp_root / f"p{i}.{name}.npy", array)
+            manifest.append({"key": list(key), "file": f"p{i}", "height": part.height})
+        with open(tmp_root / "manifest.json", "w") as f:
+            json.dump({"pos_cols": pos_cols, "partitions": manifest}, f)
+
+        # Move into place only once complete so readers never see partial indexes
+        tmp_root.rename(root)
+
+    @classmethod
+    def _open(cls, root: Path) -> "PositionIndex":
+        "Memory-map the arrays listed in root's manifest"
+        with open(root / "manifest.json") as f:
+            manifest = json.load(f)
+        names = ["start", "order"] + (["end"] if len(manifest["pos_cols"]) == 2 else [])
+        partitions = {
+            tuple(part["key"]): {
+                name: np.load(root / f"{part['file']}.{name}.npy", mmap_mode="r")
+                for name in names
+            }
+            for part in manifest["partitions"]
+        }
+        return cls(root, partitions)
+
+    def get(self, key: tuple) -> Dict[str, np.ndarray] | None:
+        "Arrays for partition key, or None if the source has no rows there"
+        return self.partitions.get(key)
+
+    def sorted_positions(self, key: tuple) -> Tuple[np.ndarray, np.ndarray] | None:
+        "(sorted_pos, order) for partition key, as used by nearest"
+        part = self.get(key)
+        return None if part is None else (part["start"], part["order"])
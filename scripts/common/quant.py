@@ -0,0 +1,66 @@
+from pathlib import Path
+import polars as pl
+
+def scan_quant(path: str | Path) -> pl.LazyFrame:
+    "Scan an ENCODE/RSEM quantification TSV, stripping ID version suffixes"
+    return (
+        pl.scan_csv(path, separator="\t")
+        .with_columns(
+            gene_id = pl.col.gene_id.str.extract(r"(ENSG[0-9]+)+\.[0-9]", 1),
+            transcript_id = pl.col.transcript_id.str.extract(r"(ENST[0-9]+)+\.[0-9]", 1)
+        )
+    )
+
+def aggregate_replicates(
+        paths: list[str | Path],
+        key: list[str] = ["transcript_id", "gene_id"],
+        columns: list[str] = None,
+        min_replicates: int = None
+    ) -> pl.DataFrame:
+    """
+    Per-key mean, geometric mean and variance of numeric columns across replicates.
+
+    Replicates are stacked in long format and reduced with one streaming
+    group_by, so the work grows linearly with the number of replicates
+    rather than building a wide joined table. Rows sharing a key within one
+    replicate (e.g. an ID and its _PAR_Y copy once versions are stripped)
+    are summed first, so each replicate contributes one value per key.
+    Output columns are '{col}_arithm', '{col}_geom' and '{col}_var' for
+    each column, plus 'n_replicates'.
+
+    columns: columns to aggregate (default: all numeric non-key columns)
+    min_replicates: keep keys found in at least this many replicates
+        (default: all of them, as an inner join would)
+    """
+    if min_replicates is None:
+        min_replicates = len(paths)
+    # The scans are read concurrently when the concatenated plan runs
+    scans = [scan_quant(path) for path in paths]
+    if columns is None:
+        schema = scans[0].collect_schema()
+        columns = [col for col, dtype in schema.items() if dtype.is_numeric() and col not in key]
+    replicates = pl.concat(
+        [scan.select(*key, *columns).with_columns(replicate=pl.lit(i)) for i, scan in enumerate(scans)],
+        how="vertical"
+    )
+
+    aggs = []
+    for col in columns:
+        value = pl.col(col).cast(pl.Float64)
+        aggs += [
+            value.mean().alias(f"{col}_arithm"),
+            value.log().mean().exp().alias(f"{col}_geom"),
+            value.var().alias(f"{col}_var"),
+        ]
+    return (
+        replicates
+        # Rows without a versioned primary ID (e.g. spike-ins) are dropped
+        .filter(pl.col(key[0]).is_not_null())
+        .group_by(*key, "replicate")
+        .agg(pl.col(columns).sum())
+        .group_by(key)
+        .agg(pl.col.replicate.n_unique().alias("n_replicates"), *aggs)
+        .filter(pl.col.n_replicates >= min_replicates)
+        .sort(key)
+        .collect(engine="streaming")
+    )
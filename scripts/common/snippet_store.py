@@ -0,0 +1,159 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Iterator
+import numpy as np
+import polars as pl
+
+class SnippetStore:
+    """
+    On-disk store of pileup snippets for one .hic file and extraction setting.
+
+    The store directory is keyed by the .hic file (path, size and mtime),
+    resolution, flank, normalization and matrix type. Within it, each
+    category holds append-only parts: 'part-{k}.npy', a float32
+    (n, 2f+1, 2f+1) array read by memory map, and 'part-{k}.parquet',
+    which maps every loop_id attempted in that part to its row in the
+    array (null for loops whose windows left the chromosome). Requests for
+    any set of loop_ids are served from the parts that hold them, so only
+    loops never seen before need extracting.
+    """
+    def __init__(
+            self,
+            hic_path: str | Path,
+            resolution: int,
+            flank_bins: int,
+            normalization: str,
+            matrix_type: str,
+            root: str | Path = "output/cache/snippets"
+        ):
+        hic_path = Path(hic_path)
+        stat = hic_path.stat()
+        self.key = {
+            "hic": str(hic_path.resolve()),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "resolution": resolution,
+            "flank_bins": flank_bins,
+            "normalization": normalization,
+            "matrix_type": matrix_type,
+        }
+        digest = hashlib.sha256(json.dumps(self.key, sort_keys=True).encode()).hexdigest()
+        self.dir = Path(root) / f"{hic_path.name}-{digest[:16]}"
+
+    def _category_dir(self, category: str | tuple) -> Path:
+        if isinstance(category, tuple):
+            category = "-".join(str(part) for part in category)
+        return self.dir / str(category)
+
+    def index(self, category: str | tuple) -> pl.DataFrame:
+        "loop_id, part and snippet row of every loop attempted for category"
+        # By part number, i.e. append order: part-10 follows part-9, not part-1
+        parts = sorted(
+            self._category_dir(category).glob("part-*.parquet"),
+            key=lambda part: int(part.stem.removeprefix("part-"))
+        )
+        if not parts:
+            return pl.DataFrame(schema={"loop_id": pl.Int64, "part": pl.Int64, "snippet": pl.Int64})
+        return pl.concat([
+            pl.read_parquet(part).with_columns(part=pl.lit(int(part.stem.removeprefix("part-")), pl.Int64))
+            for part in parts
+        ]).select("loop_id", "part", "snippet")
+
+    def missing(self, category: str | tuple, loop_ids: pl.Series) -> pl.Series:
+        "loop_ids not yet attempted for category"
+        return loop_ids.filter(~loop_ids.cast(pl.Int64).is_in(self.index(category)["loop_id"].implode()))
+
+    def append(
+            self,
+            category: str | tuple,
+            loop_ids: pl.Series,
+            loop_index: np.ndarray,
+            snippets: np.ndarray
+        ):
+        """
+        Add a part for attempted loop_ids, of which snippets[i] belongs to
+        loop_ids[loop_index[i]] (as returned by extract_snippets).
+        """
+        assert len(loop_index) == len(snippets), (
+            f"{len(snippets)} snippets for {len(loop_index)} loop indices"
+        )
+        category_dir = self._category_dir(category)
+        category_dir.mkdir(parents=True, exist_ok=True)
+        if not (self.dir / "key.json").exists():
+            (self.dir / "key.json").write_text(json.dumps(self.key, indent=2))
+        k = len(list(category_dir.glob("part-*.parquet")))
+
+        snippet = np.full(len(loop_ids), -1, dtype=np.int64)
+        snippet[loop_index] = np.arange(len(loop_index))
+        index = pl.DataFrame({
+            "loop_id": loop_ids.cast(pl.Int64),
+            "snippet": pl.Series(snippet).set(pl.Series(snippet == -1), None),
+        })
+
+        # The index is written last, so an interrupted append leaves no part
+        with open(category_dir / f"part-{k}.npy", "wb") as f:
+            np.save(f, np.ascontiguousarray(snippets, dtype=np.float32))
+        index.write_parquet(category_dir / f"part-{k}.parquet.tmp")
+        (category_dir / f"part-{k}.parquet.tmp").rename(category_dir / f"part-{k}.parquet")
+
+    def append_categories(
+            self,
+            loops: pl.DataFrame,
+            category_cols: list[str],
+            loop_index: np.ndarray,
+            snippets: np.ndarray
+        ):
+        """
+        Add one part per category for a batch of loops spanning several
+        categories, of which snippets[i] belongs to loops[loop_index[i]].
+        """
+        for category, df in loops.with_row_index("_batch_row").partition_by(category_cols, as_dict=True).items():
+            rows = df["_batch_row"].to_numpy()
+            in_category = np.isin(loop_index, rows)
+            self.append(category, df["loop_id"], np.searchsorted(rows, loop_index[in_category]), snippets[in_category])
+
+    def iter_snippets(
+            self,
+            category: str | tuple,
+            loop_ids: pl.Series,
+            batch_size: int = 10_000
+        ) -> Iterator[np.ndarray]:
+        """
+        Stored snippets of loop_ids, in batches read from the memory-mapped parts.
+
+        Snippets come in the order of loop_ids, skipping loops attempted but
+        out of bounds. Every loop_id must have been attempted; see missing.
+        """
+        # A loop appended twice is read from its first part
+        index = self.index(category).unique("loop_id", keep="first", maintain_order=True)
+        found = pl.DataFrame({"loop_id": loop_ids.cast(pl.Int64)}).join(
+            index, on="loop_id", how="left", maintain_order="left"
+        )
+        assert found["part"].null_count() == 0, (
+            f"{found['part'].null_count()} loop_ids of {category} not in snippet store"
+        )
+        found = found.drop_nulls("snippet")
+        parts = found["part"].to_numpy()
+        rows = found["snippet"].to_numpy()
+        category_dir = self._category_dir(category)
+        arrays = {
+            part: np.load(category_dir / f"part-{part}.npy", mmap_mode="r")
+            for part in np.unique(parts)
+        }
+        w = 2 * self.key["flank_bins"] + 1
+        for start in range(0, len(rows), batch_size):
+            batch_parts, batch_rows = parts[start:start + batch_size], rows[start:start + batch_size]
+            batch = np.empty((len(batch_rows), w, w), dtype=np.float32)
+            for part in np.unique(batch_parts):
+                in_part = batch_parts == part
+                batch[in_part] = arrays[part][batch_rows[in_part]]
+            yield batch
+
+    def load(self, category: str | tuple, loop_ids: pl.Series) -> np.ndarray:
+        "Stored snippets of loop_ids, in their order, stacked into one (n, 2f+1, 2f+1) array"
+        batches = list(self.iter_snippets(category, loop_ids))
+        if not batches:
+            w = 2 * self.key["flank_bins"] + 1
+            return np.empty((0, w, w), dtype=np.float32)
+        return np.concatenate(batches)
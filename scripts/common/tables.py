@@ -0,0 +1,65 @@
+import shutil
+from pathlib import Path
+import polars as pl
+
+# (partition column, sort column) pairs tried in order by write_table
+LAYOUTS = [("chrom", "start"), ("chrom1", "start1")]
+
+# Small row groups keep min/max statistics selective for region queries
+ROW_GROUP_SIZE = 16_384
+
+def table_layout(columns: list[str]) -> tuple[str, str] | None:
+    "First layout whose columns are all present, or None for non-genomic tables"
+    for layout in LAYOUTS:
+        if all(col in columns for col in layout):
+            return layout
+    return None
+
+def _remove(path: Path):
+    "Delete a file or directory if it exists"
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+def write_table(
+        df: pl.DataFrame,
+        path: str | Path,
+        layout: tuple[str, str] | None = "auto",
+        row_group_size: int = ROW_GROUP_SIZE
+    ):
+    """
+    Write df as a parquet dataset hive-partitioned by chromosome.
+
+    Each partition is written to '{path}/{chrom col}={value}/0.parquet' with
+    rows sorted by position and min/max statistics per row group, so scans
+    filtering on chromosome read one partition and scans filtering on
+    position skip most row groups. The chromosome column is kept in the
+    files, so pl.scan_parquet(path) returns the original columns in order.
+
+    layout is a (partition column, sort column) pair; by default the first
+    of LAYOUTS found in df. Tables with neither, and empty tables, are
+    written as a single file.
+    """
+    path = Path(path)
+    if layout == "auto":
+        layout = table_layout(df.columns)
+    tmp_path = path.with_name(path.name + ".tmp")
+    _remove(tmp_path)
+    if layout is None or df.is_empty():
+        df.write_parquet(tmp_path, row_group_size=row_group_size, statistics=True)
+    else:
+        partition_col, sort_col = layout
+        assert df[partition_col].null_count() == 0, f"Null values in partition column '{partition_col}'"
+        for (value,), part in df.partition_by(partition_col, as_dict=True, maintain_order=True).items():
+            part_dir = tmp_path / f"{partition_col}={value}"
+            part_dir.mkdir(parents=True)
+            (
+                part
+                .sort(sort_col, maintain_order=True)
+                .write_parquet(part_dir / "0.parquet", row_group_size=row_group_size, statistics=True)
+            )
+
+    # Replace the old table (file or dataset) only once the new one is complete
+    _remove(path)
+    tmp_path.rename(path)
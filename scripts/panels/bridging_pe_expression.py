@@ -13,8 +13,12 @@ import numpy as np
 import statsmodels.formula.api as smf
 
 loops = pl.read_parquet("input/data/transcript_pe_loop_counts.parquet")
-enhancers = pl.read_parquet("input/data/enhancers.parquet")
-transcripts = pl.read_parquet("input/data/transcript_quant.parquet")
+enhancers = pl.scan_parquet("input/data/enhancers.parquet").select("chrom", "start", "end").collect()
+transcripts = (
+    pl.scan_parquet("input/data/transcript_quant.parquet")
+    .select("transcript_id", "chrom", "tss", "pme_TPM_arithm")
+    .collect()
+)
 x_levels = 4
 
 min_expr = (
@@ -10,7 +10,11 @@ import polars as pl
 import seaborn as sns
 import numpy as np
 
-anchors = pl.read_parquet("input/data/anchor_neighbors.parquet")
+anchors = (
+    pl.scan_parquet("input/data/anchor_neighbors.parquet")
+    .select("nn_dist_tss", "nn_dist_enh", "nn_dist_coh")
+    .collect()
+)
 
 # 80mm x 35mm
 fig = plt.figure(figsize=(3.14,1.38), layout="constrained")
@@ -3,8 +3,10 @@
 # %autoreload 2
 #%%
 from typing import List
-import pickle
+import hashlib
+import json
 import time
+from pathlib import Path
 import polars as pl
 import numpy as np
 import hictkpy
@@ -13,103 +15,36 @@ import matplotlib.pyplot as plt
 import matplotlib as mpl
 from matplotlib.colors import LogNorm
 from params import LoopRegulatoryCategoryAbbr as Reg, MetaloopHeatmapPanel as Panel, seed, Aesthetics as Aes
+from common.pileup import extract_snippets, extract_snippets_multires, PileupAggregator
+from common.snippet_store import SnippetStore
+from common.pileup_stats import bootstrap_ci, permutation_test, center_enrichment
+from common.tables import write_table
 
 
 #%%
-
-
-
-
-######################################################
-#   Helper methods to extract matrices for pileup
-######################################################
-def in_bounds(size, start, end):
-    "Check that start and end are in chrom bounds"
-    return start >= 0 and end < size
-
-def as_ucsc(chrom, start, end):
-    "Format as UCSC string"
-    return "{}:{}-{}".format(chrom, start, end)
-
-loops_loaded = 0
-
-def extract_matrices(
-        loops: pl.DataFrame, 
-        hic: hictkpy.File, 
-        flank_bp: int, 
-        normalization: str
-    ) -> np.typing.NDArray:
-    """
-    Create individual numpy matrices as basis for pileup
-    """
-    global loops_loaded
-    resolution = hic.resolution()
-    loops = (
-        loops.with_columns(
-            center1 = (pl.col.start1 + pl.col.end1)//2,
-            center2 = (pl.col.start2 + pl.col.end2)//2,
-        )
-        .with_columns(
-            center_snap1 = ((pl.col.center1 / resolution).round() * resolution).cast(pl.Int64),
-            center_snap2 = ((pl.col.center2 / resolution).round() * resolution).cast(pl.Int64)
-        )
-        .with_columns(
-            flank_start1 = pl.col.center_snap1 - flank_bp,
-            flank_end1 = pl.col.center_snap1 + flank_bp,
-            flank_start2 = pl.col.center_snap2 - flank_bp,
-            flank_end2 = pl.col.center_snap2 + flank_bp
-        )
-    )
-    matrices = []
-    chromsizes = hic.chromosomes()
-    
-    for loop in loops.iter_rows(named=True):
-        # Extract anchor position
-        chrom1, start1, end1 = loop["chrom1"], loop["flank_start1"], loop["flank_end1"]
-        chrom2, start2, end2 = loop["chrom2"], loop["flank_start2"], loop["flank_end2"]
-
-        # Ensure loop anchor flanks are on chromosome
-        if not in_bounds(chromsizes[chrom1], start1, end1):
-            continue
-        if not in_bounds(chromsizes[chrom2], start2, end2):
-            continue
-
-        # Format for retrieval from contact matrix
-        range1 = as_ucsc(chrom1, start1, end1)
-        range2 = as_ucsc(chrom2, start2, end2)
-
-        # Extract contact matrix
-        matrix = hic.fetch(
-            range1, 
-            range2, 
-            normalization
-        ).to_numpy()
-        matrices.append(matrix)
-
-        loops_loaded += 1
-        if loops_loaded % 100 == 0:
-            print("Loops loaded:", loops_loaded)
-
-    return np.array(matrices)
-#%%
 ###################################################
 # Open input data
 ###################################################
 
 # Get the loop categories to analyze
 loops = (
-    pl.read_parquet("input/data/loop_categories.parquet")
+    pl.scan_parquet("input/data/loop_categories.parquet")
+    .select("loop_id", "chrom1", "start1", "end1", "chrom2", "start2", "end2", "regulation", "cohesin")
     .filter(
         pl.col.regulation.is_in(Panel.use_reg_categories),
         pl.col.end2 - pl.col.start1 > Panel.min_loop_distance
     )
+    .collect()
+    # Sampling below depends on row order, which the partitioned layout does not fix
+    .sort("loop_id")
 )
 
 #%%
 
 # Open matrix to extract matrices from
+hic_path = "raw/ContactMatrix/inter.hic"
 hic = hictkpy.File(
-    "raw/ContactMatrix/inter.hic", 
+    hic_path, 
     resolution=Panel.resolution,
     matrix_type=Panel.matrix_type
 )
@@ -119,35 +54,43 @@ hic = hictkpy.File(
 ######################################################
 
 # Generate pileups for each category
-matrices = {}
 print(Panel.loop_sample_size_per_category)
-loops_loaded=0
-for category, df in loops.partition_by(["regulation", "cohesin"], as_dict=True).items():
-    # Get uniform-size individual loop matrices going into the pileup
-    flank_bp = Panel.resolution * Panel.flank_bins
-    cat_matrices = extract_matrices(
-        df.sample(Panel.loop_sample_size_per_category, seed=seed),
-        hic,
-        flank_bp,
-        Panel.normalization
-    )
-    assert cat_matrices.shape[0] == Panel.loop_sample_size_per_category
-    matrices[category] = cat_matrices
-
-with open(f"output/data/metaloop_heatmap_matrices_{Panel.matrix_type}.pickle", "wb") as matrix_file:
-    pickle.dump(matrices, file=matrix_file)
+sample_size = Panel.loop_sample_size_per_category
+window = 2 * Panel.flank_bins + 1
+category_cols = ["regulation", "cohesin"]
+sampled = pl.concat([
+    df if sample_size is None else df.sample(sample_size, seed=seed)
+    for df in loops.partition_by(category_cols)
+])
+store = SnippetStore(hic_path, Panel.resolution, Panel.flank_bins, Panel.normalization, Panel.matrix_type)
+
+# Only loops not already in the snippet store are extracted, in batches in
+# genomic order so nearby loops share fetch boxes. metaloop_snippets.py
+# fills the store for whole categories on a process pool beforehand.
+missing = pl.concat([
+    df.filter(pl.col.loop_id.is_in(store.missing(category, df["loop_id"]).implode()))
+    for category, df in sampled.partition_by(category_cols, as_dict=True).items()
+])
+loops_loaded = 0
+for batch in missing.sort("chrom1", "start1").iter_slices(Panel.extract_batch_size):
+    snippets, loop_index = extract_snippets(batch, hic, Panel.flank_bins, Panel.normalization)
+    store.append_categories(batch, category_cols, loop_index, snippets)
+    loops_loaded += len(batch)
+    print("Loops loaded:", loops_loaded)
 #%%
 
-with open(f"output/data/metaloop_heatmap_matrices_{Panel.matrix_type}.pickle", "rb") as matrix_file:
-    matrices = pickle.load(matrix_file)
+# Aggregate stored snippets into pileups, reading them in batches from disk
 pileups = {}
 vmin, vmax = None, None
-for category, cat_matrices in matrices.items():
-    # Aggregate matrices into pileup
-    pileup = Panel.aggregation_method(
-        cat_matrices,
-        axis=0
+for category, df in sampled.partition_by(category_cols, as_dict=True).items():
+    aggregator = PileupAggregator((window, window))
+    for snippets in store.iter_snippets(category, df["loop_id"]):
+        aggregator.add(snippets)
+    n_snippets = aggregator.count[0, 0] + aggregator.nan_count[0, 0]
+    assert sample_size is None or n_snippets == sample_size, (
+        f"{n_snippets} of {sample_size} loops in {category} extracted"
     )
+    pileup = aggregator.aggregate(Panel.aggregation)
     pileups[category] = pileup
 
     nanmin = np.nanmin(pileup[pileup>0])
@@ -155,7 +98,138 @@ for category, cat_matrices in matrices.items():
     nanmax = np.nanmax(pileup[pileup>0])
     vmax = nanmax if vmax is None else max(vmax, nanmax)
 
+#%%
+######################################################
+#   Pileup statistics
+######################################################
+
+# Bootstrap CIs and center enrichment per category, and a label permutation
+# test of each category against the reference cohesin category. Resampling
+# takes seconds per category, so results are cached by the snippet store,
+# the sampled loops and the resampling settings, and a re-plot reads them.
+statistic = "median" if Panel.aggregation == "median" else "mean"
+category_loops = dict(sorted(
+    (category, df["loop_id"].sort())
+    for category, df in sampled.partition_by(category_cols, as_dict=True).items()
+))
+stats_key = {
+    "store": store.key,
+    "loops": {
+        "-".join(category): hashlib.sha256(loop_ids.to_numpy().tobytes()).hexdigest()
+        for category, loop_ids in category_loops.items()
+    },
+    "statistic": statistic,
+    "n_resamples": Panel.n_resamples,
+    "seed": seed,
+    "reference_coh_category": Panel.reference_coh_category,
+}
+stats_digest = hashlib.sha256(json.dumps(stats_key, sort_keys=True).encode()).hexdigest()
+stats_cache = Path("output/cache/metaloop_stats") / f"{store.dir.name}-{stats_digest[:16]}.parquet"
+
+if stats_cache.exists():
+    stats = pl.read_parquet(stats_cache)
+else:
+    # Snippets are loaded one category at a time, plus each reference
+    reference_snippets = {}
+    stats = []
+    for (reg, coh), loop_ids in category_loops.items():
+        snippets = store.load((reg, coh), loop_ids)
+        ci = bootstrap_ci(snippets, Panel.n_resamples, statistic, seed=seed)
+        row = {
+            "regulation": reg,
+            "cohesin": coh,
+            "n_loops": len(snippets),
+            "enrichment": ci["enrichment"],
+            "enrichment_lower": ci["enrichment_ci"][0],
+            "enrichment_upper": ci["enrichment_ci"][1],
+            "enrichment_p_value": ci["p_value"],
+            "reference_difference": None,
+            "reference_p_value": None,
+        }
+        reference = (reg, Panel.reference_coh_category)
+        if coh != Panel.reference_coh_category and reference in category_loops:
+            if reference not in reference_snippets:
+                reference_snippets[reference] = store.load(reference, category_loops[reference])
+            test = permutation_test(snippets, reference_snippets[reference], Panel.n_resamples, statistic, seed=seed)
+            row["reference_difference"] = test["enrichment_difference"]
+            row["reference_p_value"] = test["p_value"]
+        stats.append(row)
+    stats = pl.DataFrame(stats, schema_overrides={"reference_difference": pl.Float64, "reference_p_value": pl.Float64})
+    del reference_snippets
+    stats_cache.parent.mkdir(parents=True, exist_ok=True)
+    stats.write_parquet(stats_cache.with_name(stats_cache.name + ".tmp"))
+    stats_cache.with_name(stats_cache.name + ".tmp").rename(stats_cache)
+with pl.Config(set_tbl_cols=-1):
+    print(stats)
+write_table(stats, f"output/data/metaloop_heatmap_stats_{Panel.matrix_type}.parquet")
 
+#%%
+######################################################
+#   Resolution robustness
+######################################################
+
+# Pileups at several resolutions over the same flank, extracted in one pass
+# with one open file per resolution. Loops are kept only if they fit at
+# every resolution, so these snippets have their own stores.
+# Skipped when Panel.robustness_resolutions is empty, as by default.
+resolutions = Panel.robustness_resolutions
+if resolutions:
+    flank_bp = Panel.resolution * Panel.flank_bins
+    hics = {
+        resolution: hic if resolution == Panel.resolution else hictkpy.File(
+            hic_path,
+            resolution=resolution,
+            matrix_type=Panel.matrix_type
+        )
+        for resolution in resolutions
+    }
+    res_stores = {
+        resolution: SnippetStore(
+            hic_path,
+            resolution,
+            flank_bp // resolution,
+            Panel.normalization,
+            Panel.matrix_type,
+            root=f"output/cache/snippets/multires-{'-'.join(map(str, resolutions))}"
+        )
+        for resolution in resolutions
+    }
+    missing = pl.concat([
+        df.filter(pl.any_horizontal(
+            pl.col.loop_id.is_in(res_store.missing(category, df["loop_id"]).implode())
+            for res_store in res_stores.values()
+        ))
+        for category, df in sampled.partition_by(category_cols, as_dict=True).items()
+    ])
+    loops_loaded = 0
+    for batch in missing.sort("chrom1", "start1").iter_slices(Panel.extract_batch_size):
+        snippets, loop_index = extract_snippets_multires(batch, hics, flank_bp, Panel.normalization)
+        for resolution, res_store in res_stores.items():
+            res_store.append_categories(batch, category_cols, loop_index, snippets[resolution])
+        loops_loaded += len(batch)
+        print("Loops loaded:", loops_loaded)
+
+    resolution_stats = []
+    for category, df in sampled.partition_by(category_cols, as_dict=True).items():
+        for resolution, res_store in res_stores.items():
+            window = 2 * (flank_bp // resolution) + 1
+            aggregator = PileupAggregator((window, window))
+            for snippets in res_store.iter_snippets(category, df["loop_id"]):
+                aggregator.add(snippets)
+            resolution_stats.append({
+                "regulation": category[0],
+                "cohesin": category[1],
+                "resolution": resolution,
+                "n_loops": int(aggregator.count[0, 0] + aggregator.nan_count[0, 0]),
+                "enrichment": float(center_enrichment(
+                    aggregator.aggregate(Panel.aggregation),
+                    corner_bins=max(1, window // 7)
+                )),
+            })
+    resolution_stats = pl.DataFrame(resolution_stats)
+    with pl.Config(set_tbl_cols=-1, set_tbl_rows=-1):
+        print(resolution_stats.pivot("resolution", index=category_cols, values="enrichment"))
+    write_table(resolution_stats, f"output/data/metaloop_heatmap_resolutions_{Panel.matrix_type}.parquet")
 
 #%%
 ######################################################
@@ -0,0 +1,43 @@
+#%%
+import polars as pl
+from params import MetaloopHeatmapPanel as Panel
+from common.pileup import extract_snippets_parallel
+from common.snippet_store import SnippetStore
+
+# Pre-extract metaloop heatmap snippets for every loop of the panel's
+# categories on a process pool, filling the snippet store that
+# metaloop_heatmap.py reads. Spawned workers re-import this script, so all
+# work runs under the __main__ guard.
+
+def fill_store(loops: pl.DataFrame, hic_path: str, category_cols: list[str], n_workers: int = None):
+    "Extract and store snippets of loops not yet in the store"
+    store = SnippetStore(hic_path, Panel.resolution, Panel.flank_bins, Panel.normalization, Panel.matrix_type)
+    missing = pl.concat([
+        df.filter(pl.col.loop_id.is_in(store.missing(category, df["loop_id"]).implode()))
+        for category, df in loops.partition_by(category_cols, as_dict=True).items()
+    ])
+    for batch in missing.sort("chrom1", "start1").iter_slices(Panel.extract_batch_size):
+        snippets, loop_index = extract_snippets_parallel(
+            batch,
+            hic_path,
+            Panel.resolution,
+            Panel.matrix_type,
+            Panel.flank_bins,
+            Panel.normalization,
+            shard_by=category_cols,
+            n_workers=n_workers
+        )
+        store.append_categories(batch, category_cols, loop_index, snippets)
+
+if __name__ == "__main__":
+    loops = (
+        pl.scan_parquet("input/data/loop_categories.parquet")
+        .select("loop_id", "chrom1", "start1", "end1", "chrom2", "start2", "end2", "regulation", "cohesin")
+        .filter(
+            pl.col.regulation.is_in(Panel.use_reg_categories),
+            pl.col.end2 - pl.col.start1 > Panel.min_loop_distance
+        )
+        .collect()
+    )
+    fill_store(loops, "raw/ContactMatrix/inter.hic", ["regulation", "cohesin"], Panel.extract_workers)
+# %%
@@ -19,10 +19,11 @@ loop_strength_expected_expr = pl.max_horizontal(
 loop_strength_expr = pl.col.observed / loop_strength_expected_expr
 
 loops = (
-    pl.read_parquet("input/data/loop_categories.parquet")
+    pl.scan_parquet("input/data/loop_categories.parquet")
+    .select("loop_id", "regulation", "cohesin")
     .join(
         (
-            pl.read_parquet("input/data/loops.parquet")
+            pl.scan_parquet("input/data/loops.parquet")
             .with_columns(
                 loop_strength = loop_strength_expr
             )
@@ -30,6 +31,7 @@ loops = (
         ),
         on = "loop_id"
     )
+    .collect()
 )
 # 80mm x 59mm
 fig = plt.figure(figsize=(3.149,2.32), layout="constrained")
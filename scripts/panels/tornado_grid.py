@@ -1,39 +1,25 @@
 #%%
 from dataclasses import dataclass
 #%%
-import pyBigWig
 import polars as pl
-from collections import defaultdict
 import numpy as np
-
-loops = (
-    pl.read_parquet("input/data/loop_categories.parquet")
-    .filter(pl.col.regulation.is_in(["B"]))
-)
-
-tfs = {
-    "RAD21": "input/data/RAD21_ENCFF994GBG.bigWig",
-    "SMC3": "input/data/SMC3_ENCFF596CNE.bigWig",
-    "CTCF": "input/data/CTCF_ENCFF336UPT.bigWig"
-}
-
-tf_data = defaultdict(list)
-for name, path in tfs.items():
-    file = pyBigWig.open(path)
-    for category, loop_cat in loops.partition_by("regulation", "cohesin", as_dict=True).items():
-        loop_cat = loop_cat.sample(792, seed=42)
-        for loop in loop_cat.iter_rows(named=True):
-            center1 = (loop["start1"]+loop["end1"])//2
-            center2 = (loop["start2"]+loop["end2"])//2
-            a1 = file.stats(loop["chrom1"], center1-2000, center1+2000, nBins=20)
-            a2 = file.stats(loop["chrom2"], center2-2000, center2+2000, nBins=20)
-            k1 = (*category, name, "a1")
-            k2 = (*category, name, "a2")
-            tf_data[k1].append(a1)
-            tf_data[k2].append(a2)
-for k, a in tf_data.items():
-    tf_data[k] = np.array(a)
-
+from tornado_signal import tracks as tfs, sample_loops, anchor_signal
+
+# 792 loops sampled per category, shared by all tracks
+sampled = sample_loops()
+n = len(sampled)
+
+# Binned mean signal at both anchors of each loop, for all tracks at once.
+# Run tornado_signal.py first to extract it on a process pool; otherwise
+# it is extracted here, in this process, and cached.
+track_means = anchor_signal(sampled, n_workers=1)
+
+tf_data = {}
+for name, means in track_means.items():
+    for category, loop_cat in sampled.partition_by("regulation", "cohesin", as_dict=True).items():
+        rows = loop_cat["row"].to_numpy()
+        tf_data[(*category, name, "a1")] = means[rows]
+        tf_data[(*category, name, "a2")] = means[n + rows]
 
 #%%
 import matplotlib as mpl
@@ -0,0 +1,80 @@
+#%%
+import hashlib
+import json
+from pathlib import Path
+import numpy as np
+import polars as pl
+from params import TornadoGridPanel as Panel
+from common.bigwig import track_window_means
+
+# Binned track signal at both anchors of the tornado grid's sampled loops.
+# Running this script extracts it for all tracks on a process pool and
+# caches it for tornado_grid.py. Spawned workers re-import this script, so
+# all work runs under the __main__ guard.
+
+tracks = {
+    "RAD21": "input/data/RAD21_ENCFF994GBG.bigWig",
+    "SMC3": "input/data/SMC3_ENCFF596CNE.bigWig",
+    "CTCF": "input/data/CTCF_ENCFF336UPT.bigWig"
+}
+
+def sample_loops() -> pl.DataFrame:
+    "Bridging PE loops sampled per cohesin category, with their 'row' in the signal arrays"
+    loops = (
+        pl.scan_parquet("input/data/loop_categories.parquet")
+        .select("loop_id", "chrom1", "start1", "end1", "chrom2", "start2", "end2", "regulation", "cohesin")
+        .filter(pl.col.regulation.is_in(["B"]))
+        .collect()
+        # Sampling below depends on row order, which the partitioned layout does not fix
+        .sort("loop_id")
+    )
+    return pl.concat([
+        loop_cat.sample(Panel.loop_sample_size_per_category, seed=42)
+        for loop_cat in loops.partition_by("regulation", "cohesin")
+    ]).with_row_index("row")
+
+def cache_path(sampled: pl.DataFrame, root: str | Path = "output/cache/tornado_grid") -> Path:
+    "Cache file keyed by the tracks (path, size and mtime), the sampled loops and the binning"
+    stats = {name: Path(path).stat() for name, path in tracks.items()}
+    anchors = sampled.select("loop_id", "chrom1", "start1", "end1", "chrom2", "start2", "end2").write_csv()
+    key = {
+        "tracks": {
+            name: [str(Path(path).resolve()), stats[name].st_size, stats[name].st_mtime_ns]
+            for name, path in tracks.items()
+        },
+        "loops": hashlib.sha256(anchors.encode()).hexdigest(),
+        "flank": Panel.flank,
+        "n_bins": Panel.n_bins,
+    }
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+    return Path(root) / f"track_means-{digest[:16]}.npz"
+
+def anchor_signal(sampled: pl.DataFrame, n_workers: int = None) -> dict[str, np.ndarray]:
+    """
+    {track name: (2n, n_bins) binned means} for n sampled loops, anchor 1
+    in rows [0, n) and anchor 2 in rows [n, 2n).
+
+    Read from the cache if present, otherwise extracted with n_workers
+    processes (see track_window_means) and cached.
+    """
+    path = cache_path(sampled)
+    if path.exists():
+        with np.load(path) as cached:
+            return {name: cached[name] for name in tracks}
+    centers = pl.concat([(sampled[f"start{i}"] + sampled[f"end{i}"]) // 2 for i in [1, 2]]).to_numpy()
+    chroms = pl.concat([sampled["chrom1"], sampled["chrom2"]])
+    track_means = track_window_means(tracks, chroms, centers, Panel.flank, Panel.n_bins, n_workers)
+
+    # Move into place only once complete so readers never see a partial cache
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **track_means)
+    tmp_path.rename(path)
+    return track_means
+
+if __name__ == "__main__":
+    sampled = sample_loops()
+    track_means = anchor_signal(sampled, Panel.extract_workers)
+    print(f"{len(tracks)} tracks at {len(sampled)} loops cached in {cache_path(sampled)}")
+# %%
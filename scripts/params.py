@@ -1,5 +1,4 @@
 import polars as pl
-import numpy as np
 import matplotlib.pyplot as plt
 
 seed = 42
@@ -9,62 +8,75 @@ class BPThresholds:
     promoter_is_proximal = 1000
     cohesin_is_proximal = 2900
 
-class ProxDistAbbr:
-    prox = "P"
-    dist = "D"
-    prox_pl = pl.lit("P")
-    dist_pl = pl.lit("D")
+class ProxFlag:
+    "Bits of an anchor's UInt8 proximity mask (set when the nearest element is proximal)"
+    enh = 1
+    pro = 2
+    coh = 4
+    bits = 3
+
+    @classmethod
+    def mask(cls, **proximal: pl.Expr) -> pl.Expr:
+        "UInt8 mask from boolean expressions named enh, pro, coh (null counts as distal)"
+        return pl.sum_horizontal(
+            expr.fill_null(False).cast(pl.UInt8) * getattr(cls, name)
+            for name, expr in proximal.items()
+        ).cast(pl.UInt8)
+
+    @classmethod
+    def table(cls, category, dtype: pl.Enum) -> pl.Series:
+        "category(mask1, mask2) for each of the 64 values of mask1 | mask2 << bits"
+        n = 1 << cls.bits
+        return pl.Series([category(key % n, key // n) for key in range(n * n)], dtype=dtype)
+
+    @classmethod
+    def lookup(cls, category, dtype: pl.Enum, prox1: str, prox2: str) -> pl.Expr:
+        "Label loops by indexing the category table with both anchors' masks"
+        key = pl.col(prox1).cast(pl.UInt32) + pl.col(prox2).cast(pl.UInt32) * (1 << cls.bits)
+        return pl.lit(cls.table(category, dtype)).gather(key)
 
 class LoopCohesinCategoryAbbr:
     prox_prox = "D" # Dependent
     prox_dist = "H" # Hemi-independent
     dist_dist = "I" # Independent
-    prox_prox_pl = pl.lit("D")
-    prox_dist_pl = pl.lit("H")
-    dist_dist_pl = pl.lit("I")
+    dtype = pl.Enum([prox_prox, prox_dist, dist_dist])
 
     @classmethod
-    def label(cls, df: pl.DataFrame, col1, col2) -> pl.Expr:
-        col1_pl = pl.col(col1)
-        col2_pl = pl.col(col2)
-        prox_pl = ProxDistAbbr.prox_pl
-        dist_pl = ProxDistAbbr.dist_pl
-        return (
-            pl.when(col1_pl == prox_pl, col2_pl == prox_pl)
-            .then(cls.prox_prox_pl)
-            .when(col1_pl == prox_pl, col2_pl == dist_pl)
-            .then(cls.prox_dist_pl)
-            .when(col1_pl == dist_pl, col2_pl == prox_pl)
-            .then(cls.prox_dist_pl)
-            .when(col1_pl == dist_pl, col2_pl == dist_pl)
-            .then(cls.dist_dist_pl)
-        )
+    def category(cls, prox1: int, prox2: int) -> str:
+        n_prox = bool(prox1 & ProxFlag.coh) + bool(prox2 & ProxFlag.coh)
+        return [cls.dist_dist, cls.prox_dist, cls.prox_prox][n_prox]
+
+    @classmethod
+    def label(cls, prox1: str, prox2: str) -> pl.Expr:
+        return ProxFlag.lookup(cls.category, cls.dtype, prox1, prox2)
 
 class LoopRegulatoryCategoryAbbr:
     bridging_pe = "B"
     nonregulatory = "NR"
     other = "O"
-    bridging_pe_pl = pl.lit("B")
-    nonregulatory_pl = pl.lit("NR")
-    other_pl = pl.lit("O")
+    dtype = pl.Enum([bridging_pe, nonregulatory, other])
+
+    @classmethod
+    def category(cls, prox1: int, prox2: int) -> str:
+        pro1, enh1 = bool(prox1 & ProxFlag.pro), bool(prox1 & ProxFlag.enh)
+        pro2, enh2 = bool(prox2 & ProxFlag.pro), bool(prox2 & ProxFlag.enh)
+        if (pro1 and not enh1 and enh2) or (pro2 and not enh2 and enh1):
+            return cls.bridging_pe
+        if not (pro1 or enh1 or pro2 or enh2):
+            return cls.nonregulatory
+        return cls.other
 
     @classmethod
-    def label(cls, df: pl.DataFrame, nn_pro1, nn_enh1, nn_pro2, nn_enh2) -> pl.Expr:
-        nn_pro1_pl = pl.col(nn_pro1)
-        nn_enh1_pl = pl.col(nn_enh1)
-        nn_pro2_pl = pl.col(nn_pro2)
-        nn_enh2_pl = pl.col(nn_enh2)
-        prox_pl = ProxDistAbbr.prox_pl
-        dist_pl = ProxDistAbbr.dist_pl
-        return (
-            pl.when(nn_pro1_pl == prox_pl, nn_enh1_pl == dist_pl, nn_enh2_pl == prox_pl)
-            .then(cls.bridging_pe_pl)
-            .when(nn_pro2_pl == prox_pl, nn_enh2_pl == dist_pl, nn_enh1_pl == prox_pl)
-            .then(cls.bridging_pe_pl)
-            .when(nn_pro1_pl == dist_pl, nn_enh1_pl == dist_pl, nn_pro2_pl == dist_pl, nn_enh2_pl == dist_pl)
-            .then(cls.nonregulatory_pl)
-            .otherwise(cls.other_pl)
-        )
+    def label(cls, prox1: str, prox2: str) -> pl.Expr:
+        return ProxFlag.lookup(cls.category, cls.dtype, prox1, prox2)
+
+class ThresholdSweep:
+    # Proximity thresholds (bp) swept by 12_threshold_sweep
+    enhancer = [250, 500, 1000, 1500, 2000, 2900, 4000, 5000, 7500, 10000]
+    promoter = [250, 500, 1000, 1500, 2000, 2900, 4000, 5000, 7500, 10000]
+    cohesin = [250, 500, 1000, 1500, 2000, 2900, 4000, 5000, 7500, 10000]
+    # Also write each loop's labels at every threshold
+    write_labels = False
 
 class MetaloopHeatmapPanel:
     # Analysis
@@ -72,10 +84,22 @@ class MetaloopHeatmapPanel:
     flank_bins = 10
     matrix_type = "oe"
     normalization = "RU"
-    aggregation_method = np.nanmedian
+    # PileupAggregator.aggregate method ("median" is approximate, see its docstring)
+    aggregation = "median"
 
-    # All categories have 792+ loops (BI has exactly 792)
+    # All categories have 792+ loops (BI has exactly 792); None uses all loops
     loop_sample_size_per_category = 792
+    # Processes used by metaloop_snippets.py to pre-extract snippets (None: all cores)
+    extract_workers = None
+    # Loops extracted at a time before folding into the pileups
+    extract_batch_size = 20_000
+    # Bootstrap resamples and label permutations for pileup statistics
+    n_resamples = 1000
+    # Cohesin category each other category is compared to by permutation
+    reference_coh_category = LoopCohesinCategoryAbbr.dist_dist
+    # Resolutions compared over the same flank in bp (resolution * flank_bins),
+    # e.g. [1000, 2000, 5000, 10000]; empty skips the comparison
+    robustness_resolutions = []
     min_loop_distance = 50_000
     use_reg_categories = [
         LoopRegulatoryCategoryAbbr.bridging_pe, 
@@ -91,6 +115,15 @@ class MetaloopHeatmapPanel:
     panel_columns = 1
     page_depth_frac = .25
 
+class TornadoGridPanel:
+    # Loops sampled per category, shared by all tracks
+    loop_sample_size_per_category = 792
+    # Window around each anchor center, and bins across it
+    flank = 2000
+    n_bins = 20
+    # Processes used by tornado_signal.py to pre-extract track signal (None: all cores)
+    extract_workers = None
+
 class Aesthetics:
     mm2inch = .03937
     col_w_mm = 90
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Scripts import the shared modules as 'common' and 'params' from scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
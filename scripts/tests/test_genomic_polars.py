@@ -0,0 +1,317 @@
+import numpy as np
+import polars as pl
+import pytest
+from scipy.sparse.csgraph import connected_components
+from common import genomic_polars
+from common.position_index import PositionIndex
+
+def random_positions(seed: int, n: int, high: int = 100_000) -> np.ndarray:
+    return np.random.default_rng(seed).integers(0, high, n)
+
+def brute_nearest_dists(from_pos: np.ndarray, to_pos: np.ndarray, k: int) -> np.ndarray:
+    "(n, k) sorted distances to the k nearest targets, -1 where there are fewer"
+    dists = np.full((len(from_pos), k), -1)
+    if len(to_pos):
+        nearest = np.sort(np.abs(from_pos[:, None] - to_pos[None, :]), axis=1)[:, :k]
+        dists[:, :nearest.shape[1]] = nearest
+    return dists
+
+@pytest.mark.parametrize("k", [1, 3])
+def test_nearest_sorted_matches_brute_force(k):
+    from_df = pl.DataFrame({"pos": random_positions(0, 500)})
+    to_df = pl.DataFrame({"to_pos": random_positions(1, 200), "name": [f"t{i}" for i in range(200)]})
+    result = genomic_polars.nearest(from_df, to_df, ["pos"], ["to_pos"], {"k": k}, engine="sorted")
+
+    expected = brute_nearest_dists(from_df["pos"].to_numpy(), to_df["to_pos"].to_numpy(), k)
+    for i in range(k):
+        assert result[f"dist{i + 1}"].to_list() == expected[:, i].tolist()
+        # Neighbor columns belong to the neighbor at that distance
+        assert ((result["pos"] - result[f"to_pos{i + 1}"]).abs() == result[f"dist{i + 1}"]).all()
+    assert result["pos"].equals(from_df["pos"])
+
+def test_nearest_sorted_matches_kdtree():
+    from_df = pl.DataFrame({"pos": random_positions(2, 300)})
+    # Distinct targets, so both engines agree on neighbors as well as distances
+    to_df = pl.DataFrame({"to_pos": np.random.default_rng(3).permutation(100_000)[:100]})
+    kw = {"k": 2}
+    by_sorted = genomic_polars.nearest(from_df, to_df, ["pos"], ["to_pos"], kw, engine="sorted")
+    by_kdtree = genomic_polars.nearest(from_df, to_df, ["pos"], ["to_pos"], kw, engine="kdtree")
+    for i in [1, 2]:
+        assert np.allclose(by_sorted[f"dist{i}"].to_numpy(), by_kdtree[f"dist{i}"].to_numpy())
+    # Ties between equidistant targets may be broken differently, distances may not
+    untied = by_sorted["dist1"] != by_sorted["dist2"]
+    assert by_sorted.filter(untied)["to_pos1"].equals(by_kdtree.filter(untied)["to_pos1"])
+
+@pytest.mark.parametrize("engine", ["sorted", "kdtree"])
+def test_nearest_missing_neighbors(engine):
+    from_df = pl.DataFrame({"pos": [0, 40, 100]})
+    to_df = pl.DataFrame({"to_pos": [10, 90]})
+    result = genomic_polars.nearest(from_df, to_df, ["pos"], ["to_pos"], {"k": 3}, engine=engine)
+    assert result["dist3"].null_count() == 3
+    assert result["to_pos3"].null_count() == 3
+    assert result["to_pos1"].to_list() == [10, 10, 90]
+
+    empty = genomic_polars.nearest(from_df, to_df.clear(), ["pos"], ["to_pos"], engine=engine)
+    assert empty["dist1"].null_count() == 3
+    assert empty["to_pos1"].null_count() == 3
+
+def test_nearest_sorted_ties_go_to_lower_position():
+    from_df = pl.DataFrame({"pos": [50]})
+    to_df = pl.DataFrame({"to_pos": [60, 40]})
+    result = genomic_polars.nearest(from_df, to_df, ["pos"], ["to_pos"], {"k": 2}, engine="sorted")
+    assert result.row(0, named=True) == {"pos": 50, "dist1": 10, "dist2": 10, "to_pos1": 40, "to_pos2": 60}
+
+def count_rows(df1, df2, label):
+    "Module-level so that process pools can pickle it"
+    return pl.DataFrame({
+        "label": [label],
+        "chrom": [(df1 if df1 is not None else df2)["chrom"][0]],
+        "n1": [None if df1 is None else len(df1)],
+        "n2": [None if df2 is None else len(df2)],
+    })
+
+@pytest.mark.parametrize("executor", [None, "thread", "process"])
+@pytest.mark.parametrize("how", ["inner", "left", "outer"])
+def test_partition_overlaps_keys(how, executor):
+    df1 = pl.DataFrame({"chrom": ["chr2", "chr1", "chr2", "chr3"]})
+    df2 = pl.DataFrame({"chrom": ["chr4", "chr2", "chr1", "chr1"]})
+    result = genomic_polars.partition_overlaps(
+        count_rows, df1, df2, ["chrom"], a=["x"], how=how, executor=executor, n_workers=2
+    )
+    expected = {
+        "inner": [("chr1", 1, 2), ("chr2", 2, 1)],
+        "left": [("chr1", 1, 2), ("chr2", 2, 1), ("chr3", 1, 0)],
+        "outer": [("chr1", 1, 2), ("chr2", 2, 1), ("chr3", 1, None), ("chr4", None, 1)],
+    }[how]
+    assert result.select("chrom", "n1", "n2").rows() == expected
+    assert (result["label"] == "x").all()
+
+def test_partition_overlaps_lazy_and_key_kw():
+    df1 = pl.DataFrame({"chrom": ["chr2", "chr1", "chr2"]})
+    df2 = pl.DataFrame({"chrom": ["chr2", "chr1"]})
+    result = genomic_polars.partition_overlaps(
+        count_rows, df1.lazy(), df2.lazy(), ["chrom"], key_kw=lambda key: {"label": key[0]}
+    )
+    assert result.rows() == [("chr1", "chr1", 1, 1), ("chr2", "chr2", 2, 1)]
+
+def random_intervals(seed: int, n: int, max_len: int = 2_000, name: str = "id") -> pl.DataFrame:
+    rng = np.random.default_rng(seed)
+    start = rng.integers(0, 50_000, n)
+    return pl.DataFrame({
+        name: np.arange(n),
+        "chrom": rng.choice(["chr1", "chr2", "chr3"], n),
+        "start": start,
+        "end": start + rng.integers(0, max_len, n),
+    })
+
+def brute_window_pairs(df1, df2, left_on, right_on, distance) -> pl.DataFrame:
+    "(id1, id2) pairs on the same chrom whose gap is less than distance"
+    start1, end1 = pl.col(left_on[0]), pl.col(left_on[-1])
+    start2, end2 = pl.col(right_on[0] + "_2"), pl.col(right_on[-1] + "_2")
+    return (
+        df1.join(df2.rename(lambda col: col + "_2"), how="cross")
+        .filter(pl.col.chrom == pl.col.chrom_2, pl.max_horizontal(start2 - end1, start1 - end2) < distance)
+        .select("id1", id2="id2_2")
+        .sort("id1", "id2")
+    )
+
+@pytest.mark.parametrize("distance", [0, 1, 500])
+@pytest.mark.parametrize("cols", [["start"], ["start", "end"]])
+def test_window_join_matches_brute_force(cols, distance):
+    df1 = random_intervals(4, 300, name="id1")
+    df2 = random_intervals(5, 200, name="id2").filter(pl.col.chrom != "chr3")
+    expected = brute_window_pairs(df1, df2, cols, cols, distance)
+
+    inner = genomic_polars.window_join(df1, df2, cols, cols, distance)
+    assert inner.select("id1", "id2").sort("id1", "id2").equals(expected)
+    # Collisions are suffixed and the partition column is kept once
+    assert {"start_right", "end_right"} <= set(inner.columns) and "chrom_right" not in inner.columns
+
+    matched = expected["id1"].unique().sort()
+    semi = genomic_polars.window_join(df1, df2, cols, cols, distance, how="semi")
+    anti = genomic_polars.window_join(df1, df2, cols, cols, distance, how="anti")
+    assert semi["id1"].sort().equals(matched)
+    # Anti joins keep rows of chr3, which df2 lacks entirely
+    assert anti["id1"].sort().equals(df1.filter(~pl.col.id1.is_in(matched.implode()))["id1"])
+    assert semi.columns == anti.columns == df1.columns
+
+def test_window_join_positions_to_intervals():
+    df1 = random_intervals(6, 300, name="id1").with_columns(pos=pl.col.start)
+    df2 = random_intervals(7, 200, name="id2")
+    expected = brute_window_pairs(df1, df2, ["pos"], ["start", "end"], 100)
+    result = genomic_polars.window_join(df1, df2, ["pos"], ["start", "end"], 100)
+    assert result.select("id1", "id2").sort("id1", "id2").equals(expected)
+
+def test_window_join_no_shared_partitions():
+    df1 = random_intervals(8, 10, name="id1").with_columns(chrom=pl.lit("chrA"))
+    df2 = random_intervals(9, 10, name="id2")
+    inner = genomic_polars.window_join(df1, df2, ["start", "end"], ["start", "end"])
+    assert inner.height == 0 and "id2" in inner.columns
+    assert genomic_polars.window_join(df1, df2, ["start"], ["start"], how="anti").equals(df1)
+
+def test_nearest_gathers_neighbor_columns_in_row_order():
+    rng = np.random.default_rng(10)
+    # Duplicate, unsorted query rows must keep their order and each get their neighbors
+    from_df = pl.DataFrame({"x": rng.random(200), "y": rng.random(200)})
+    from_df = pl.concat([from_df, from_df.head(20)])
+    to_df = pl.DataFrame({"tx": rng.random(50), "ty": rng.random(50), "name": [f"t{i}" for i in range(50)]})
+    result = genomic_polars.nearest(
+        from_df, to_df, ["x", "y"], ["tx", "ty"], {"k": 2},
+        join_to_df_cols=["name"], to_df_col=r"{col}_{i}"
+    )
+    assert result.columns == ["x", "y", "dist1", "dist2", "name_1", "name_2"]
+    assert result.select("x", "y").equals(from_df)
+
+    from_xy = from_df.to_numpy()
+    to_xy = to_df.select("tx", "ty").to_numpy()
+    dists = np.linalg.norm(from_xy[:, None, :] - to_xy[None, :, :], axis=2)
+    order = np.argsort(dists, axis=1)
+    for i in range(2):
+        assert result[f"name_{i + 1}"].to_list() == to_df["name"].gather(order[:, i]).to_list()
+        assert np.allclose(result[f"dist{i + 1}"].to_numpy(), dists[np.arange(len(from_df)), order[:, i]])
+
+def test_nearest_without_distances():
+    from_df = pl.DataFrame({"pos": [5, 25]})
+    to_df = pl.DataFrame({"to_pos": [0, 30], "name": ["a", "b"]})
+    result = genomic_polars.nearest(from_df, to_df, ["pos"], ["to_pos"], join_dist=False, join_to_df_cols=["name"])
+    assert result.rows() == [(5, "a"), (25, "b")]
+
+@pytest.mark.parametrize("executor", [None, "thread"])
+def test_nearest_many_matches_nearest_per_chrom(executor):
+    from_df = random_intervals(11, 300)
+    to_dfs = {
+        "a": random_intervals(12, 100, name="a_id"),
+        # No chr3 targets, so chr3 rows get null neighbors
+        "b": random_intervals(13, 100, name="b_id").filter(pl.col.chrom != "chr3"),
+    }
+    result = genomic_polars.nearest_many(
+        from_df, to_dfs, ["start"], {"a": ["start"], "b": ["end"]},
+        join_to_df_cols={"a": ["a_id"], "b": ["b_id"]}, executor=executor, query_kw={"k": 2}
+    )
+
+    expected = []
+    for (chrom,), part in sorted(from_df.partition_by("chrom", as_dict=True).items()):
+        for name, to_col in [("a", "start"), ("b", "end")]:
+            to_part = to_dfs[name].filter(pl.col.chrom == chrom)
+            part = genomic_polars.nearest(
+                part, to_part, ["start"], [to_col], {"k": 2},
+                dist_col=f"dist_{name}{{i}}", join_to_df_cols=[f"{name}_id"]
+            )
+        expected.append(part)
+    expected = pl.concat(expected)
+    assert result.equals(expected)
+    assert result.filter(pl.col.chrom == "chr3")["b_id1"].null_count() == (from_df["chrom"] == "chr3").sum()
+
+def brute_stranded(from_pos: np.ndarray, to_pos: np.ndarray, to_strand: np.ndarray) -> dict[str, list]:
+    "Signed distance to the nearest target in each direction, None if there is none"
+    stranded = np.isin(to_strand, ["+", "-"])
+    sign = np.where(to_strand[stranded] == "-", -1, 1)
+    signed = (from_pos[:, None] - to_pos[None, stranded]) * sign[None, :]
+    expected = {"upstream": [], "downstream": [], "any": []}
+    for row in signed:
+        up, down = row[row <= 0], row[row >= 0]
+        up = up.max() if len(up) else None
+        down = down.min() if len(down) else None
+        expected["upstream"].append(up)
+        expected["downstream"].append(down)
+        # Upstream wins ties
+        if up is None or (down is not None and down < -up):
+            expected["any"].append(down)
+        else:
+            expected["any"].append(up)
+    return expected
+
+def test_nearest_stranded_matches_brute_force():
+    rng = np.random.default_rng(14)
+    from_df = pl.DataFrame({"pos": rng.integers(0, 10_000, 300)})
+    to_df = pl.DataFrame({
+        "tss": rng.integers(0, 10_000, 80),
+        "strand": rng.choice(["+", "-", "."], 80),
+    })
+    result = genomic_polars.nearest_stranded(from_df, to_df, "pos", "tss")
+    expected = brute_stranded(from_df["pos"].to_numpy(), to_df["tss"].to_numpy(), to_df["strand"].to_numpy())
+    for direction in ["any", "upstream", "downstream"]:
+        assert result[f"sdist_{direction}"].to_list() == expected[direction]
+        # The gathered neighbor is at the reported signed distance
+        neighbor_dist = (
+            (pl.col.pos - pl.col(f"tss_{direction}"))
+            * pl.when(pl.col(f"strand_{direction}") == "-").then(-1).otherwise(1)
+        )
+        assert result.select((neighbor_dist == pl.col(f"sdist_{direction}")).all()).item()
+
+def test_nearest_stranded_missing_directions():
+    from_df = pl.DataFrame({"pos": [50, 150]})
+    to_df = pl.DataFrame({"tss": [100, 100], "strand": ["+", "."], "gene": ["a", "b"]})
+    result = genomic_polars.nearest_stranded(
+        from_df, to_df, "pos", "tss", directions=["upstream", "downstream"], join_to_df_cols=["gene"]
+    )
+    assert result.rows() == [(50, -50, "a", None, None), (150, None, None, 50, "a")]
+
+def test_count_within_matches_brute_force(tmp_path):
+    from_df = random_intervals(15, 300).with_columns(pos=pl.col.start)
+    to_df = (
+        random_intervals(16, 200, name="to_id")
+        .filter(pl.col.chrom != "chr3")
+        .with_columns(score=pl.col.to_id.cast(pl.Float64).sqrt())
+    )
+    windows = [1, 500, 5_000]
+    result = genomic_polars.count_within(from_df, to_df, "pos", "start", windows, weight_col="score")
+    assert result.columns == from_df.columns + [
+        col for window in windows for col in [f"n_within_{window}", f"score_within_{window}"]
+    ]
+
+    # Counts and sums over the pairs window_join finds, zero without any (e.g. on chr3)
+    result = result.sort("id")
+    for window in windows:
+        pairs = brute_window_pairs(
+            from_df.rename({"id": "id1"}), to_df.rename({"to_id": "id2"}), ["pos"], ["start"], window
+        ).join(to_df.select(id2="to_id", score="score"), on="id2")
+        expected = (
+            from_df.select(id1="id")
+            .join(pairs.group_by("id1").agg(n=pl.len(), score=pl.col.score.sum()), on="id1", how="left")
+            .fill_null(0)
+            .sort("id1")
+        )
+        assert result[f"n_within_{window}"].to_list() == expected["n"].to_list()
+        assert np.allclose(result[f"score_within_{window}"].to_numpy(), expected["score"].to_numpy())
+
+    path = tmp_path / "targets.parquet"
+    to_df.write_parquet(path)
+    index = PositionIndex.load(path, ["start"])
+    by_index = genomic_polars.count_within(from_df, to_df, "pos", "start", windows, weight_col="score", index=index)
+    assert by_index.sort("id").equals(result)
+
+def brute_merge(df: pl.DataFrame, distance: int) -> pl.DataFrame:
+    "Connected components of intervals on a chrom whose gap is at most distance"
+    merged = []
+    for (chrom,), part in df.partition_by("chrom", as_dict=True).items():
+        start, end = part["start"].to_numpy(), part["end"].to_numpy()
+        gap = np.maximum(start[None, :] - end[:, None], start[:, None] - end[None, :])
+        _, labels = connected_components(gap <= distance, directed=False)
+        merged.append(
+            part.with_columns(group=labels)
+            .group_by("chrom", "group")
+            .agg(pl.col.start.min(), pl.col.end.max(), n_merged=pl.len(), sources=pl.col.factor.unique().sort())
+            .drop("group")
+        )
+    return pl.concat(merged).sort("chrom", "start")
+
+@pytest.mark.parametrize("distance", [0, 100])
+def test_merge_intervals_matches_brute_force(distance):
+    peaks = random_intervals(18, 400, max_len=300).with_columns(
+        factor=pl.Series(np.random.default_rng(19).choice(["RAD21", "SMC3", "CTCF"], 400))
+    )
+    result = genomic_polars.merge_intervals(peaks, distance=distance, source_col="factor", aggs=[pl.col.id])
+    assert result.columns == ["chrom", "start", "end", "n_merged", "sources", "id"]
+    expected = brute_merge(peaks, distance)
+    assert result.drop("id").sort("chrom", "start").equals(expected.select(result.columns[:-1]))
+    # Every source interval lands in exactly one merged interval
+    assert result["id"].explode().sort().to_list() == list(range(400))
+
+    supported = genomic_polars.merge_intervals(peaks, distance=distance, source_col="factor", min_sources=2)
+    assert supported.sort("chrom", "start").equals(expected.filter(pl.col.sources.list.len() >= 2))
+
+def test_merge_intervals_book_ended():
+    df = pl.DataFrame({"chrom": ["chr1"] * 4, "start": [0, 10, 21, 5], "end": [10, 20, 30, 8]})
+    assert genomic_polars.merge_intervals(df).rows() == [("chr1", 0, 20, 3), ("chr1", 21, 30, 1)]
+    assert genomic_polars.merge_intervals(df, distance=1).rows() == [("chr1", 0, 30, 4)]
@@ -0,0 +1,42 @@
+import polars as pl
+from common.gtf import parse_attributes, parse_gtf
+
+KEYS = ["gene_id", "gene_name", "transcript_id", "exon_number"]
+
+def parse(attributes):
+    return parse_attributes(pl.Series("attribute", attributes), KEYS)
+
+def test_semicolon_inside_value():
+    df = parse([
+        'gene_id "ENSG1.1"; gene_name "A;B"; transcript_id "ENST1.1"; exon_number 2;',
+        'gene_id "ENSG2.1"; gene_name "C; gene_id \\"X\\"";',
+    ])
+    assert df.row(0) == ("ENSG1.1", "A;B", "ENST1.1", "2")
+    # A key inside a quoted value is not a pair of its own
+    assert df.row(1) == ("ENSG2.1", 'C; gene_id "X"', None, None)
+
+def test_escaped_quotes_and_repeated_keys():
+    df = parse([
+        r'havana_gene_id "OTT1"; gene_id "ENSG1.1"; gene_name "say \"hi\""; tag "basic"; tag "CCDS";',
+        r'gene_name "back\\slash"; gene_name "second"; exon_number 12',
+    ])
+    assert df.row(0) == ("ENSG1.1", 'say "hi"', None, None)
+    assert df.row(1) == (None, "back\\slash", None, "12")
+
+def test_lines_without_keys():
+    df = parse(['tag "basic";', "", 'exon_number 3; gene_id "ENSG1.1";'])
+    assert df.columns == KEYS
+    assert df.rows() == [(None, None, None, None), (None, None, None, None), ("ENSG1.1", None, None, "3")]
+
+def test_parse_gtf(tmp_path):
+    path = tmp_path / "genes.gtf"
+    path.write_text(
+        "##description: test\n"
+        'chr1\tTEST\tgene\t11\t100\t.\t+\t.\tgene_id "ENSG1.1"; gene_type "lncRNA"; gene_name "X; Y";\n'
+        'chr1\tTEST\texon\t11\t50\t.\t+\t.\tgene_id "ENSG1.1"; transcript_id "ENST1.2"; exon_number 1;\n'
+    )
+    gtf = parse_gtf(path)
+    assert gtf["gene_name"].to_list() == ["X; Y", ""]
+    assert gtf["transcript_id"].to_list() == ["", "ENST1"]
+    assert gtf["transcript_id_full"].to_list() == ["", "ENST1.2"]
+    assert gtf["exon_number"].to_list() == [None, 1]
@@ -0,0 +1,52 @@
+import itertools
+import polars as pl
+from params import ProxFlag, LoopCohesinCategoryAbbr, LoopRegulatoryCategoryAbbr
+
+def all_mask_pairs() -> pl.DataFrame:
+    "Every pair of anchor masks, with each flag as the 'P'/'D' labels steps 08/09 used to write"
+    pairs = pl.DataFrame(
+        list(itertools.product(range(1 << ProxFlag.bits), repeat=2)),
+        schema={"prox1": pl.UInt8, "prox2": pl.UInt8},
+        orient="row"
+    )
+    return pairs.with_columns(
+        pl.when((pl.col(f"prox{i}") & getattr(ProxFlag, flag)) > 0).then(pl.lit("P")).otherwise(pl.lit("D"))
+        .alias(f"nn_{flag}{i}")
+        for flag in ["enh", "pro", "coh"]
+        for i in [1, 2]
+    )
+
+def test_mask():
+    df = pl.DataFrame({
+        "enh": [True, False, None, True],
+        "pro": [False, False, True, True],
+        "coh": [True, None, False, True],
+    })
+    masks = df.select(prox=ProxFlag.mask(enh=pl.col.enh, pro=pl.col.pro, coh=pl.col.coh))["prox"]
+    assert masks.dtype == pl.UInt8
+    assert masks.to_list() == [ProxFlag.enh | ProxFlag.coh, 0, ProxFlag.pro, 7]
+
+def test_cohesin_categories_match_explicit_rule():
+    pairs = all_mask_pairs()
+    labels = pairs.select(LoopCohesinCategoryAbbr.label("prox1", "prox2").alias("cohesin"))["cohesin"]
+    assert labels.dtype == LoopCohesinCategoryAbbr.dtype
+    expected = [
+        {("P", "P"): "D", ("P", "D"): "H", ("D", "P"): "H", ("D", "D"): "I"}[coh1, coh2]
+        for coh1, coh2 in pairs.select("nn_coh1", "nn_coh2").rows()
+    ]
+    assert labels.to_list() == expected
+
+def test_regulatory_categories_match_explicit_rule():
+    pairs = all_mask_pairs()
+    labels = pairs.select(LoopRegulatoryCategoryAbbr.label("prox1", "prox2").alias("regulation"))["regulation"]
+    assert labels.dtype == LoopRegulatoryCategoryAbbr.dtype
+    expected = []
+    for pro1, enh1, pro2, enh2 in pairs.select("nn_pro1", "nn_enh1", "nn_pro2", "nn_enh2").rows():
+        if (pro1, enh1, enh2) == ("P", "D", "P") or (pro2, enh2, enh1) == ("P", "D", "P"):
+            expected.append("B")
+        elif (pro1, enh1, pro2, enh2) == ("D", "D", "D", "D"):
+            expected.append("NR")
+        else:
+            expected.append("O")
+    assert labels.to_list() == expected
+    assert set(expected) == {"B", "NR", "O"}
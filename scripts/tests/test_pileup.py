@@ -0,0 +1,51 @@
+import numpy as np
+import polars as pl
+from common.pileup import extract_snippets
+
+class Matrix:
+    "Minimal in-memory stand-in for a hictkpy.File at one resolution"
+    def __init__(self, resolution, chromsizes, seed=0):
+        rng = np.random.default_rng(seed)
+        self.res = resolution
+        self.sizes = chromsizes
+        self.bins = {chrom: size // resolution + 1 for chrom, size in chromsizes.items()}
+        self.pixels = {
+            (chrom1, chrom2): rng.random((self.bins[chrom1], self.bins[chrom2]))
+            for chrom1 in chromsizes for chrom2 in chromsizes
+        }
+
+    def resolution(self):
+        return self.res
+
+    def chromosomes(self):
+        return self.sizes
+
+    def fetch(self, range1, range2, normalization):
+        (chrom1, span1), (chrom2, span2) = range1.split(":"), range2.split(":")
+        start1, end1 = (int(x) // self.res for x in span1.split("-"))
+        start2, end2 = (int(x) // self.res for x in span2.split("-"))
+        box = self.pixels[chrom1, chrom2][start1:end1 + 1, start2:end2 + 1]
+        return type("Result", (), {"to_numpy": lambda _: box.copy()})()
+
+def test_batched_matches_per_loop():
+    hic = Matrix(1000, {"chr1": 2_000_000, "chr2": 1_000_000})
+    rng = np.random.default_rng(1)
+    n = 500
+    chrom2 = rng.choice(["chr1", "chr2"], n)
+    start1 = rng.integers(0, 1_000_000, n)
+    start2 = np.where(chrom2 == "chr1", start1 + rng.integers(30_000, 900_000, n), rng.integers(0, 1_000_000, n))
+    loops = pl.DataFrame({
+        "chrom1": ["chr1"] * n,
+        "start1": start1,
+        "end1": start1 + 5000,
+        "chrom2": chrom2,
+        "start2": start2,
+        "end2": start2 + 5000,
+    })
+
+    snippets, loop_index = extract_snippets(loops, hic, 10, "NONE", max_box_bins=64)
+    reference, reference_index = extract_snippets(loops, hic, 10, "NONE", batched=False)
+    # Some windows leave the chromosome and are skipped by both paths
+    assert 0 < len(loop_index) < n
+    assert np.array_equal(loop_index, reference_index)
+    assert np.array_equal(snippets, reference)
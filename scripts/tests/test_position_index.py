@@ -0,0 +1,61 @@
+import numpy as np
+import polars as pl
+from common import genomic_polars
+from common.position_index import PositionIndex
+
+def write_peaks(path, seed: int, n: int = 200) -> pl.DataFrame:
+    rng = np.random.default_rng(seed)
+    start = rng.integers(0, 50_000, n)
+    df = pl.DataFrame({
+        "peak_id": np.arange(n),
+        "chrom": rng.choice(["chr1", "chr2"], n),
+        "start": start,
+        "end": start + rng.integers(0, 1_000, n),
+    })
+    df.write_parquet(path)
+    return df
+
+def test_index_is_reused_until_the_file_changes(tmp_path):
+    path = tmp_path / "peaks.parquet"
+    df = write_peaks(path, 0)
+    index = PositionIndex.load(path, ["start", "end"])
+    manifest = index.root / "manifest.json"
+    built_ns = manifest.stat().st_mtime_ns
+
+    # Same contents, so the stored index is opened rather than rebuilt
+    assert PositionIndex.load(path, ["start", "end"]).root == index.root
+    assert manifest.stat().st_mtime_ns == built_ns
+    for (chrom,), part in df.partition_by("chrom", as_dict=True).items():
+        arrays = index.get((chrom,))
+        assert arrays["start"].tolist() == part.sort("start", maintain_order=True)["start"].to_list()
+        assert part["end"].gather(arrays["order"]).to_list() == arrays["end"].tolist()
+    assert index.get(("chrX",)) is None and index.sorted_positions(("chrX",)) is None
+
+    # Indexes of other columns are kept alongside
+    start_index = PositionIndex.load(path, ["start"])
+    assert start_index.root != index.root and "end" not in start_index.get(("chr1",))
+
+    # New contents get a new index and the stale one is removed
+    new_df = write_peaks(path, 1)
+    new_index = PositionIndex.load(path, ["start", "end"])
+    assert new_index.root != index.root
+    assert not index.root.exists() and start_index.root.exists()
+    assert new_index.get(("chr1",))["start"].tolist() == (
+        new_df.filter(pl.col.chrom == "chr1")["start"].sort().to_list()
+    )
+
+def test_queries_with_index_match_without(tmp_path):
+    path = tmp_path / "peaks.parquet"
+    peaks = write_peaks(path, 2)
+    queries = write_peaks(tmp_path / "queries.parquet", 3).rename({"peak_id": "query_id"})
+
+    index = PositionIndex.load(path, ["start", "end"])
+    by_index = genomic_polars.window_join(queries, peaks, ["start", "end"], ["start", "end"], 100, index=index)
+    by_sort = genomic_polars.window_join(queries, peaks, ["start", "end"], ["start", "end"], 100)
+    assert by_index.sort("query_id", "peak_id").equals(by_sort.sort("query_id", "peak_id"))
+
+    index = PositionIndex.load(path, ["start"])
+    kw = {"join_to_df_cols": {"peaks": ["peak_id"]}, "query_kw": {"k": 2}}
+    by_index = genomic_polars.nearest_many(queries, {"peaks": peaks}, ["start"], {"peaks": ["start"]}, indexes={"peaks": index}, **kw)
+    by_sort = genomic_polars.nearest_many(queries, {"peaks": peaks}, ["start"], {"peaks": ["start"]}, **kw)
+    assert by_index.equals(by_sort)
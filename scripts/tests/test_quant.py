@@ -0,0 +1,33 @@
+import math
+from common.quant import aggregate_replicates
+
+HEADER = "transcript_id\tgene_id\tlength\tTPM\n"
+
+def write_quant(path, rows):
+    path.write_text(HEADER + "".join("\t".join(map(str, row)) + "\n" for row in rows))
+    return path
+
+def test_duplicate_key_within_replicate(tmp_path):
+    # ENST1 and its _PAR_Y copy collapse to one key in rep1 only
+    rep1 = write_quant(tmp_path / "rep1.tsv", [
+        ("ENST1.1", "ENSG1.1", 100, 2.0),
+        ("ENST1.1_PAR_Y", "ENSG1.1_PAR_Y", 100, 1.0),
+    ])
+    rep2 = write_quant(tmp_path / "rep2.tsv", [("ENST2.1", "ENSG2.1", 100, 4.0)])
+    rep3 = write_quant(tmp_path / "rep3.tsv", [
+        ("ENST1.1", "ENSG1.1", 100, 5.0),
+        ("ENST2.1", "ENSG2.1", 100, 6.0),
+    ])
+
+    agg = aggregate_replicates([rep1, rep2, rep3], columns=["TPM"], min_replicates=2)
+    # ENST1 is in 2 of 3 replicates, not 3; ENST2 is in 2
+    assert agg["transcript_id"].to_list() == ["ENST1", "ENST2"]
+    assert agg["n_replicates"].to_list() == [2, 2]
+    enst1 = agg.row(0, named=True)
+    # rep1 contributes its summed 3.0 once
+    assert enst1["TPM_arithm"] == 4.0
+    assert math.isclose(enst1["TPM_geom"], math.sqrt(15.0))
+    assert enst1["TPM_var"] == 2.0
+
+    # Requiring all replicates drops both keys
+    assert aggregate_replicates([rep1, rep2, rep3], columns=["TPM"]).is_empty()
@@ -0,0 +1,36 @@
+import numpy as np
+import polars as pl
+from common.snippet_store import SnippetStore
+
+def test_parts_read_in_append_order(tmp_path):
+    hic_path = tmp_path / "test.hic"
+    hic_path.write_bytes(b"hic")
+    store = SnippetStore(hic_path, 1000, 1, "NONE", "observed", root=tmp_path / "snippets")
+
+    # Loop 7 is appended to part 2 and again to part 10
+    for k in range(12):
+        loop_ids = pl.Series([100 + k, 7] if k in (2, 10) else [100 + k])
+        snippets = np.full((len(loop_ids), 3, 3), k, dtype=np.float32)
+        store.append("A", loop_ids, np.arange(len(loop_ids)), snippets)
+
+    assert store.index("A")["part"].to_list() == [0, 1, 2, 2, *range(3, 10), 10, 10, 11]
+    assert store.missing("A", pl.Series([7, 111, 112])).to_list() == [112]
+    # The first append of a loop is the one read back
+    assert np.all(store.load("A", pl.Series([7])) == 2)
+
+def test_snippets_in_request_order(tmp_path):
+    hic_path = tmp_path / "test.hic"
+    hic_path.write_bytes(b"hic")
+    store = SnippetStore(hic_path, 1000, 1, "NONE", "observed", root=tmp_path / "snippets")
+
+    # Snippet values encode the loop_id; loop 3 was out of bounds
+    for loop_ids in ([5, 1, 3], [4, 2]):
+        kept = [i for i, loop_id in enumerate(loop_ids) if loop_id != 3]
+        snippets = np.stack([np.full((3, 3), loop_ids[i], dtype=np.float32) for i in kept])
+        store.append("A", pl.Series(loop_ids), np.array(kept), snippets)
+
+    requested = pl.Series([2, 5, 3, 1, 4, 2])
+    assert [int(s[0, 0]) for s in store.load("A", requested)] == [2, 5, 1, 4, 2]
+    batches = list(store.iter_snippets("A", requested, batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert np.array_equal(np.concatenate(batches), store.load("A", requested))
@@ -0,0 +1,66 @@
+import numpy as np
+import polars as pl
+from common.tables import write_table
+
+def peaks(n: int = 1_000) -> pl.DataFrame:
+    rng = np.random.default_rng(0)
+    start = rng.integers(0, 1_000_000, n)
+    return pl.DataFrame({
+        "peak_id": pl.Series(np.arange(n), dtype=pl.UInt32),
+        "chrom": rng.choice(["chr1", "chr2", "chrX"], n),
+        "start": start,
+        "end": start + 500,
+        "factors": [["RAD21"] if i % 2 else ["RAD21", "SMC3"] for i in range(n)],
+    })
+
+def test_partitioned_round_trip(tmp_path):
+    df = peaks()
+    path = tmp_path / "peaks.parquet"
+    write_table(df, path, row_group_size=100)
+    assert sorted(p.name for p in path.iterdir()) == ["chrom=chr1", "chrom=chr2", "chrom=chrX"]
+
+    scanned = pl.scan_parquet(path).collect()
+    assert scanned.schema == df.schema
+    assert scanned.sort("peak_id").equals(df)
+    for part in path.iterdir():
+        stored = pl.read_parquet(part / "0.parquet")
+        assert stored["start"].is_sorted()
+        assert (stored["chrom"] == part.name.removeprefix("chrom=")).all()
+
+    region = (pl.col.chrom == "chr2") & pl.col.start.is_between(100_000, 200_000)
+    assert pl.scan_parquet(path).filter(region).collect().sort("peak_id").equals(df.filter(region))
+
+def test_loop_layout_and_ties_keep_order(tmp_path):
+    loops = pl.DataFrame({
+        "loop_id": [0, 1, 2, 3],
+        "chrom1": ["chr2", "chr1", "chr1", "chr1"],
+        "start1": [10, 30, 20, 20],
+        "chrom2": ["chr2", "chr1", "chr1", "chr1"],
+        "start2": [40, 60, 50, 50],
+    })
+    path = tmp_path / "loops.parquet"
+    write_table(loops, path)
+    assert pl.read_parquet(path / "chrom1=chr1" / "0.parquet")["loop_id"].to_list() == [2, 3, 1]
+    assert pl.scan_parquet(path).collect().sort("loop_id").equals(loops)
+
+def test_single_file_tables_and_overwrite(tmp_path):
+    path = tmp_path / "table.parquet"
+    write_table(peaks(), path)
+    assert path.is_dir()
+
+    # Non-genomic tables replace the dataset with a single file
+    quant = pl.DataFrame({"transcript_id": ["ENST1", "ENST2"], "tpm": [1.0, 2.5]})
+    write_table(quant, path)
+    assert path.is_file()
+    assert pl.read_parquet(path).equals(quant)
+
+    empty = peaks().clear()
+    write_table(empty, path)
+    assert path.is_file()
+    assert pl.read_parquet(path).equals(empty)
+
+    df = peaks(10)
+    write_table(df, path, layout=None)
+    assert path.is_file()
+    assert pl.read_parquet(path).equals(df)
+    assert [p.name for p in tmp_path.iterdir()] == ["table.parquet"]
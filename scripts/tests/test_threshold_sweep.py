@@ -0,0 +1,63 @@
+import importlib
+import itertools
+import numpy as np
+import polars as pl
+from params import BPThresholds
+
+anchor_categories = importlib.import_module("clean_data.08_anchor_categories").anchor_categories
+loop_categories = importlib.import_module("clean_data.09_loop_categories").loop_categories
+threshold_sweep = importlib.import_module("clean_data.12_threshold_sweep").threshold_sweep
+
+GRIDS = {"enhancer": [500, 1000, 2000], "promoter": [1000, 250], "cohesin": [2900, 1000, 1000]}
+
+def anchor_neighbors(n_loops: int = 300) -> pl.DataFrame:
+    "Both anchors of n_loops loops, with distances on and around the grid thresholds"
+    rng = np.random.default_rng(0)
+    values = np.array([0, 249, 250, 251, 500, 999, 1000, 1001, 2000, 2900, 5000])
+    def dists():
+        dist = rng.choice(values, 2 * n_loops)
+        return pl.Series(dist).scatter(rng.choice(2 * n_loops, 20, replace=False), None)
+    return pl.DataFrame({
+        "anchor": np.repeat([1, 2], n_loops),
+        "anchor_id": np.arange(2 * n_loops),
+        "loop_id": np.tile(rng.permutation(n_loops), 2),
+        "chrom": "chr1",
+        "start": np.arange(2 * n_loops) * 10_000,
+        "end": np.arange(2 * n_loops) * 10_000 + 5_000,
+        "nn_dist_enh": dists(),
+        "nn_dist_tss": dists(),
+        "nn_dist_coh": dists(),
+    })
+
+def test_sweep_matches_relabeling_at_each_threshold(monkeypatch):
+    neighbors = anchor_neighbors()
+    tables = threshold_sweep(neighbors, GRIDS["enhancer"], GRIDS["promoter"], GRIDS["cohesin"], labels=True)
+    counts = tables["threshold_sweep_counts"]
+    grids = {name: sorted(set(grid)) for name, grid in GRIDS.items()}
+    assert counts.height == len(list(itertools.product(*grids.values()))) * 3 * 3
+
+    # Relabel loops with steps 08 and 09 at every threshold combination
+    for enh, pro, coh in itertools.product(*grids.values()):
+        monkeypatch.setattr(BPThresholds, "enhancer_is_proximal", enh)
+        monkeypatch.setattr(BPThresholds, "promoter_is_proximal", pro)
+        monkeypatch.setattr(BPThresholds, "cohesin_is_proximal", coh)
+        anchors = anchor_categories(neighbors)["anchor_categories"]
+        loops = loop_categories(anchors)["loop_categories"].sort("loop_id")
+
+        swept = counts.filter(enhancer_bp=enh, promoter_bp=pro, cohesin_bp=coh)
+        expected = (
+            swept.select("regulation", "cohesin")
+            .join(loops.group_by("regulation", "cohesin").len(), on=["regulation", "cohesin"], how="left")
+            .fill_null(0)
+        )
+        assert swept["n_loops"].to_list() == expected["len"].to_list()
+
+        regulation = tables["threshold_sweep_regulation"].filter(enhancer_bp=enh, promoter_bp=pro)
+        cohesin = tables["threshold_sweep_cohesin"].filter(cohesin_bp=coh)
+        assert regulation.select("loop_id", "regulation").equals(loops.select("loop_id", "regulation"))
+        assert cohesin.select("loop_id", "cohesin").equals(loops.select("loop_id", "cohesin"))
+
+def test_sweep_without_labels():
+    tables = threshold_sweep(anchor_neighbors(50).lazy(), [1000], [1000], [2900], labels=False)
+    assert list(tables) == ["threshold_sweep_counts"]
+    assert tables["threshold_sweep_counts"]["n_loops"].sum() == 50